@@ -1,5 +1,6 @@
 import os
 import sys
+from datetime import timedelta
 from pathlib import Path
 
 PROJECT_ROOT = Path(__file__).resolve().parent
@@ -9,8 +10,9 @@ if str(PROJECT_ROOT) not in sys.path:
 import pandas as pd
 import streamlit as st
 
-from db import Database
-from pipeline import run_user_pipeline
+from db import Database, utcnow
+from pipeline import enqueue_analysis, get_cached_result, get_job_status
+from review_analytics import SCORES, get_review_analytics
 
 
 def _auth_gate() -> None:
@@ -35,6 +37,28 @@ def _auth_gate() -> None:
     st.stop()
 
 
+@st.fragment(run_every=1)
+def _poll_job() -> None:
+    job_id = st.session_state.get("job_id")
+    if not job_id:
+        return
+    status = get_job_status(job_id)
+    if status["status"] == "done":
+        st.session_state.result = status["result"]
+        st.session_state.job_id = (status["result"] or {}).get("refresh_job_id")
+        st.rerun()
+    elif status["status"] in {"failed", "missing"}:
+        st.session_state.job_id = None
+        if "result" in st.session_state:
+            st.session_state.result["stale"] = False
+        st.error(f"Analysis job failed: {status.get('error') or status['status']}")
+    else:
+        progress = status.get("progress") or {}
+        st.caption(f"Analysis job {progress.get('stage') or status['status']}...")
+        for rec in progress.get("recommendations") or []:
+            st.write(f"- {rec}")
+
+
 _auth_gate()
 
 st.title("Play Analyzer")
@@ -50,22 +74,35 @@ with st.sidebar:
     run = st.button("🔍 Analyze")
 
 if run:
-    with st.spinner("Working..."):
-        st.session_state.result = run_user_pipeline(
-            app_id=app_id.strip(),
-            scenario=scenario.strip() or "default",
-            user_context=user_context.strip() or None,
-            client_id=client_id.strip() or None,
-            lang=lang.strip() or "en",
-            country=country.strip() or "us",
-        )
+    st.session_state.request = {
+        "app_id": app_id.strip(),
+        "scenario": scenario.strip() or "default",
+        "user_context": user_context.strip() or None,
+        "client_id": client_id.strip() or None,
+        "lang": lang.strip() or "en",
+        "country": country.strip() or "us",
+    }
+    cached = get_cached_result(**st.session_state.request)
+    if cached is not None:
+        st.session_state.result = cached
+        st.session_state.job_id = cached.get("refresh_job_id")
+    else:
+        st.session_state.pop("result", None)
+        st.session_state.job_id = enqueue_analysis(**st.session_state.request)
+
+if st.session_state.get("job_id") and "result" not in st.session_state:
+    _poll_job()
 
 if "result" in st.session_state:
     r = st.session_state.result
     analysis = r.get("analysis") or {}
     meta = r.get("meta") or {}
 
-    st.success(f"Source: {r.get('source')}")
+    if r.get("stale"):
+        st.warning(f"Source: {r.get('source')} (analyzed at {analysis.get('analyzed_at')})")
+        _poll_job()
+    else:
+        st.success(f"Source: {r.get('source')}")
 
     col1, col2, col3 = st.columns(3)
     col1.metric("Market fit", f"{analysis.get('market_fit', '-')}/10")
@@ -83,13 +120,76 @@ if "result" in st.session_state:
     with st.expander("Raw LLM response"):
         st.json(analysis.get("raw"))
 
+    with st.expander("Metric history"):
+        try:
+            request = st.session_state.get("request") or {}
+            history = Database().get_meta_history(
+                app_id=meta.get("app_id") or request.get("app_id"),
+                lang=request.get("lang", "en"),
+                country=request.get("country", "us"),
+            )
+            if history:
+                hdf = pd.DataFrame(
+                    [
+                        {"captured_at": h.captured_at, "score": h.score, "ratings": h.ratings, "reviews": h.reviews_count}
+                        for h in history
+                    ]
+                ).set_index("captured_at")
+                st.line_chart(hdf[["score"]])
+                st.line_chart(hdf[["ratings", "reviews"]])
+            else:
+                st.caption("No history yet")
+        except Exception:
+            pass
+
+    with st.expander("Review analytics"):
+        try:
+            request = st.session_state.get("request") or {}
+            stats = get_review_analytics(
+                Database(),
+                app_id=meta.get("app_id") or request.get("app_id"),
+                lang=request.get("lang", "en"),
+                country=request.get("country", "us"),
+            )
+            if stats.summary.get("reviews"):
+                st.json(stats.summary)
+                st.bar_chart(stats.weekly[["n"]])
+                st.area_chart(stats.weekly[[f"share_{s}" for s in SCORES]])
+                st.line_chart(stats.weekly[["avg_score", "weighted_score"]])
+                st.dataframe(stats.by_version, use_container_width=True)
+            else:
+                st.caption("No reviews in window")
+        except Exception:
+            pass
+
+    with st.expander("Recent reviews"):
+        try:
+            request = st.session_state.get("request") or {}
+            # Окно по date: Postgres читает только секции последних месяцев
+            reviews = Database().get_reviews(
+                app_id=meta.get("app_id") or request.get("app_id"),
+                since=utcnow() - timedelta(days=30),
+                lang=request.get("lang", "en"),
+                country=request.get("country", "us"),
+                limit=50,
+            )
+            if reviews:
+                st.dataframe(
+                    pd.DataFrame(reviews)[["date", "score", "thumbs_up", "version", "content", "replied_at"]],
+                    use_container_width=True,
+                )
+            else:
+                st.caption("No reviews in the last 30 days")
+        except Exception:
+            pass
+
     st.subheader("Recent analyses")
     try:
         db = Database()
         with db.connect() as conn:
             df = pd.read_sql(
                 """
-                SELECT app_id, scenario, client_id, market_fit, analyzed_at
+                SELECT app_id, lang, country, scenario, client_id, market_fit, analyzed_at
                 FROM app_analysis
                 ORDER BY analyzed_at DESC
                 LIMIT 20
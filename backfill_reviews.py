@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+from dataclasses import replace
+from datetime import timedelta
+
+from config import get_env_float, get_env_int
+from db import BackfillCheckpoint, Database, utcnow
+from pipeline import META_MAX_AGE_DAYS, run_cron_refresh
+from scraper_google_play import continuation_token_from_dict, continuation_token_to_dict, iter_review_pages
+
+
+BACKFILL_PAGE_SIZE = get_env_int("BACKFILL_PAGE_SIZE", 200)
+BACKFILL_MAX_PAGES = get_env_int("BACKFILL_MAX_PAGES", 0)
+BACKFILL_PAGE_SLEEP = get_env_float("BACKFILL_PAGE_SLEEP", 2.0)
+
+
+def backfill_app(db: Database, *, app_id: str, lang: str, country: str) -> dict:
+    checkpoint = db.get_backfill_checkpoint(app_id=app_id, lang=lang, country=country)
+    if checkpoint is not None and checkpoint.status == "done":
+        return {"app_id": app_id, "status": "already_done", "reviews_inserted": checkpoint.reviews_inserted}
+
+    meta_max_age = timedelta(days=META_MAX_AGE_DAYS)
+    if db.get_meta_info(app_id=app_id, lang=lang, country=country, max_age=meta_max_age) is None:
+        run_cron_refresh(app_id=app_id, lang=lang, country=country)
+
+    if checkpoint is None:
+        checkpoint = BackfillCheckpoint(
+            app_id=app_id,
+            lang=lang,
+            country=country,
+            continuation_token=None,
+            pages=0,
+            reviews_seen=0,
+            reviews_inserted=0,
+            status="running",
+            updated_at=None,
+        )
+
+    pages_this_run = 0
+    pages = iter_review_pages(
+        app_id,
+        lang=lang,
+        country=country,
+        page_size=BACKFILL_PAGE_SIZE,
+        continuation_token=continuation_token_from_dict(checkpoint.continuation_token),
+    )
+    error = None
+    while True:
+        try:
+            page, token = next(pages)
+        except StopIteration:
+            break
+        except Exception as e:  # noqa: BLE001
+            # Запрос не удался после ретраев (в том числе самый первый): токен не двигаем,
+            # следующий запуск продолжит с него
+            error = str(e)
+            checkpoint = replace(checkpoint, status="stalled", updated_at=utcnow())
+            with db.unit_of_work() as uow:
+                uow.save_backfill_checkpoint(checkpoint)
+            break
+
+        # token=None — только конец ленты: ошибки запросов iter_review_pages не глотает
+        next_token = continuation_token_to_dict(token)
+        inserted = 0
+        with db.unit_of_work() as uow:
+            if page:
+                inserted = uow.insert_reviews(app_id=app_id, reviews=page, lang=lang, country=country)
+            updated = replace(
+                checkpoint,
+                continuation_token=next_token,
+                pages=checkpoint.pages + (1 if page else 0),
+                reviews_seen=checkpoint.reviews_seen + len(page),
+                reviews_inserted=checkpoint.reviews_inserted + inserted,
+                status="running" if next_token is not None else "done",
+                updated_at=utcnow(),
+            )
+            uow.save_backfill_checkpoint(updated)
+        checkpoint = updated
+
+        print({"app_id": app_id, "page": checkpoint.pages, "reviews": len(page), "inserted": inserted})
+
+        pages_this_run += 1
+        if next_token is None:
+            break
+        if BACKFILL_MAX_PAGES and pages_this_run >= BACKFILL_MAX_PAGES:
+            break
+        time.sleep(BACKFILL_PAGE_SLEEP)
+
+    return {
+        "app_id": app_id,
+        "status": checkpoint.status,
+        "pages": checkpoint.pages,
+        "reviews_seen": checkpoint.reviews_seen,
+        "reviews_inserted": checkpoint.reviews_inserted,
+        "error": error,
+    }
+
+
+def main() -> None:
+    app_ids = [x.strip() for x in sys.argv[1:] if x.strip()]
+    if not app_ids:
+        app_ids_raw = os.getenv("BACKFILL_APP_IDS", "")
+        app_ids = [x.strip() for x in app_ids_raw.split(",") if x.strip()]
+    if not app_ids:
+        raise RuntimeError("No app ids. Pass them as arguments or set BACKFILL_APP_IDS")
+
+    lang = os.getenv("SCRAPE_LANG", "en")
+    country = os.getenv("SCRAPE_COUNTRY", "us")
+
+    db = Database()
+    for app_id in app_ids:
+        try:
+            print(backfill_app(db, app_id=app_id, lang=lang, country=country))
+        except Exception as e:  # noqa: BLE001
+            print({"app_id": app_id, "status": "error", "error": str(e)})
+
+
+if __name__ == "__main__":
+    main()
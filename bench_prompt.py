@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+bench_prompt.py — сравнивает размер промпта (и латентность LLM) до и после компактизации meta
+
+Запуск:
+  python bench_prompt.py            # только размеры промптов по 20 последним приложениям
+  python bench_prompt.py 50 --llm   # 50 приложений + замер латентности Perplexity (без кэша)
+"""
+
+import json
+import statistics
+import sys
+import time
+from dataclasses import asdict
+from datetime import timedelta
+
+from db import Database
+from pipeline import META_MAX_AGE_DAYS
+from llm_perplexity import LLM_TEMPERATURE, _model, get_client
+from prompt_builder import PROMPT_INSTRUCTIONS, build_analysis_prompt, estimate_tokens, json_default
+
+
+def legacy_prompt(*, app_id: str, meta: dict, scenario: str) -> str:
+    return (
+        PROMPT_INSTRUCTIONS
+        + f"Scenario: {scenario}. "
+        "User context: . "
+        f"App id: {app_id}. "
+        "App data: "
+        + json.dumps(meta, ensure_ascii=False, default=json_default)
+    )
+
+
+def time_llm(prompt: str) -> float:
+    started = time.perf_counter()
+    get_client().chat.completions.create(
+        model=_model(),
+        messages=[{"role": "user", "content": prompt}],
+        temperature=LLM_TEMPERATURE,
+    )
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    limit = int(args[0]) if args else 20
+    with_llm = "--llm" in sys.argv
+
+    db = Database()
+    with db.connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT app_id FROM app_meta_info ORDER BY last_scraped DESC NULLS LAST LIMIT %s", (limit,))
+            app_ids = [row[0] for row in cur.fetchall()]
+
+    before_tokens, after_tokens, before_sec, after_sec = [], [], [], []
+    for app_id in app_ids:
+        meta_row = db.get_meta_info(app_id=app_id, max_age=timedelta(days=META_MAX_AGE_DAYS))
+        if meta_row is None:
+            continue
+        meta = asdict(meta_row)
+        old = legacy_prompt(app_id=app_id, meta=meta, scenario="default")
+        new = build_analysis_prompt(app_id=app_id, meta=meta, scenario="default", user_context=None)
+        before_tokens.append(estimate_tokens(old))
+        after_tokens.append(new.token_estimate)
+
+        row = {"app_id": app_id, "tokens_before": before_tokens[-1], "tokens_after": after_tokens[-1], "truncated": new.truncated_fields}
+        if with_llm:
+            before_sec.append(time_llm(old))
+            after_sec.append(time_llm(new.text))
+            row["llm_sec_before"] = round(before_sec[-1], 2)
+            row["llm_sec_after"] = round(after_sec[-1], 2)
+        print(row)
+
+    if not before_tokens:
+        print("No apps in app_meta_info.")
+        return
+
+    summary = {
+        "apps": len(before_tokens),
+        "tokens_before_median": statistics.median(before_tokens),
+        "tokens_after_median": statistics.median(after_tokens),
+        "tokens_saved_pct": round(100 * (1 - sum(after_tokens) / sum(before_tokens)), 1),
+    }
+    if with_llm:
+        summary["llm_sec_before_median"] = round(statistics.median(before_sec), 2)
+        summary["llm_sec_after_median"] = round(statistics.median(after_sec), 2)
+    print(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import time
+
+from config import get_env_float, get_env_int
+from db import Database, UnitOfWork
+
+
+COMPACT_BATCH = get_env_int("COMPACT_ANALYSIS_BATCH", 500)
+COMPACT_SLEEP = get_env_float("COMPACT_ANALYSIS_SLEEP", 0.2)
+
+
+def compact_batch(db: Database, *, limit: int) -> int:
+    select_sql = """
+        SELECT id, prompt_used, raw_llm_response
+        FROM app_analysis
+        WHERE prompt_hash IS NULL
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """
+    update_sql = """
+        UPDATE app_analysis
+        SET prompt_hash = %s, raw_hash = %s, prompt_used = NULL, raw_llm_response = NULL
+        WHERE id = %s
+    """
+    with db.connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(select_sql, (limit,))
+            rows = cur.fetchall()
+            uow = UnitOfWork(conn)
+            updates = [
+                (uow.put_blob("prompt", prompt_used or ""), uow.put_blob("response", raw_llm_response), analysis_id)
+                for analysis_id, prompt_used, raw_llm_response in rows
+            ]
+            uow.flush()
+            cur.executemany(update_sql, updates)
+        conn.commit()
+    return len(rows)
+
+
+def main() -> None:
+    db = Database()
+    total = 0
+    started = time.perf_counter()
+    while True:
+        moved = compact_batch(db, limit=COMPACT_BATCH)
+        if not moved:
+            break
+        total += moved
+        print({"compacted": total})
+        time.sleep(COMPACT_SLEEP)
+
+    # Место в app_analysis вернётся после VACUUM FULL / pg_repack
+    print({"status": "done", "compacted": total, "elapsed_sec": round(time.perf_counter() - started, 3)})
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,9 @@ import os
 import sys
 import psycopg
 from dotenv import load_dotenv
+from psycopg import sql
+
+from db import DEFAULT_COUNTRY, DEFAULT_LANG
 
 load_dotenv()
 
@@ -23,6 +26,7 @@ if not DATABASE_URL:
     print("Сделай: railway variables pull (создаст .env) или задай DATABASE_URL вручную.")
     sys.exit(1)
 
+# {default_lang} / {default_country} — локаль по умолчанию из db.py, подставляется литералом при выполнении
 DDL = [
     # Для UUID (gen_random_uuid)
     """
@@ -83,11 +87,14 @@ DDL = [
     );
     """,
 
-    # 3) app_reviews
+    # 3) app_reviews — секционирована по месяцу отзыва; секции создаёт db.ensure_review_partitions.
+    #    Старую несекционированную таблицу переносит partition_reviews.py migrate.
     """
     CREATE TABLE IF NOT EXISTS app_reviews (
-        id BIGSERIAL PRIMARY KEY,
+        id BIGSERIAL,
         app_id VARCHAR(255) NOT NULL REFERENCES app_meta_info(app_id) ON DELETE CASCADE,
+        lang VARCHAR(10) NOT NULL DEFAULT {default_lang},
+        country VARCHAR(10) NOT NULL DEFAULT {default_country},
 
         review_id TEXT,
         user_name TEXT,
@@ -98,15 +105,23 @@ DDL = [
         thumbs_up BIGINT,
 
         version TEXT,
-        date TIMESTAMPTZ,
+        date TIMESTAMPTZ NOT NULL,
 
         replied_at TIMESTAMPTZ,
         reply_content TEXT,
 
         scraped_at TIMESTAMPTZ DEFAULT NOW(),
 
-        UNIQUE (app_id, review_id)
-    );
+        PRIMARY KEY (id, date)
+    ) PARTITION BY RANGE (date);
+    """,
+    """
+    DO $$
+    BEGIN
+        IF (SELECT relkind FROM pg_class WHERE oid = 'app_reviews'::regclass) = 'p' THEN
+            CREATE TABLE IF NOT EXISTS app_reviews_default PARTITION OF app_reviews DEFAULT;
+        END IF;
+    END $$;
     """,
 
     # 4) app_permissions
@@ -142,16 +157,327 @@ DDL = [
     );
     """,
 
+    # 6) app_review_backfill — чекпоинты глубокой загрузки отзывов
+    """
+    CREATE TABLE IF NOT EXISTS app_review_backfill (
+        app_id VARCHAR(255) NOT NULL REFERENCES app_meta_info(app_id) ON DELETE CASCADE,
+        lang VARCHAR(10) NOT NULL,
+        country VARCHAR(10) NOT NULL,
+
+        continuation_token JSONB,
+        pages INT NOT NULL DEFAULT 0,
+        reviews_seen BIGINT NOT NULL DEFAULT 0,
+        reviews_inserted BIGINT NOT NULL DEFAULT 0,
+        status VARCHAR(20) NOT NULL DEFAULT 'running',
+
+        started_at TIMESTAMPTZ DEFAULT NOW(),
+        updated_at TIMESTAMPTZ DEFAULT NOW(),
+
+        PRIMARY KEY (app_id, lang, country)
+    );
+    """,
+
+    # 7) app_refresh_lease — аренда обновления приложения одним cron-воркером
+    """
+    CREATE TABLE IF NOT EXISTS app_refresh_lease (
+        app_id VARCHAR(255) PRIMARY KEY,
+        owner TEXT NOT NULL,
+        leased_until TIMESTAMPTZ NOT NULL,
+        claimed_at TIMESTAMPTZ DEFAULT NOW()
+    );
+    """,
+
+    # 8) analysis_jobs — очередь задач анализа для worker.py
+    """
+    CREATE TABLE IF NOT EXISTS analysis_jobs (
+        id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        kind VARCHAR(50) NOT NULL,
+        params JSONB NOT NULL,
+        dedupe_key TEXT,
+
+        status VARCHAR(20) NOT NULL DEFAULT 'queued',
+        result JSONB,
+        error TEXT,
+        attempts INT NOT NULL DEFAULT 0,
+
+        locked_by TEXT,
+        locked_until TIMESTAMPTZ,
+
+        created_at TIMESTAMPTZ DEFAULT NOW(),
+        started_at TIMESTAMPTZ,
+        finished_at TIMESTAMPTZ
+    );
+    """,
+
+    # 9) llm_response_cache — кэш ответов LLM по хэшу (модель, температура, промпт)
+    """
+    CREATE TABLE IF NOT EXISTS llm_response_cache (
+        cache_key CHAR(64) PRIMARY KEY,
+        model TEXT NOT NULL,
+        content TEXT NOT NULL,
+        size_bytes INT NOT NULL,
+        hits BIGINT NOT NULL DEFAULT 0,
+        created_at TIMESTAMPTZ DEFAULT NOW(),
+        last_hit_at TIMESTAMPTZ DEFAULT NOW()
+    );
+    """,
+
+    # 10) app_meta_locale — мета по локали (lang, country); app_meta_info хранит локаль по умолчанию
+    """
+    CREATE TABLE IF NOT EXISTS app_meta_locale (
+        app_id VARCHAR(255) NOT NULL REFERENCES app_meta_info(app_id) ON DELETE CASCADE,
+        lang VARCHAR(10) NOT NULL,
+        country VARCHAR(10) NOT NULL,
+
+        developer_key VARCHAR(255) REFERENCES app_developer(developer_key),
+
+        title TEXT,
+        summary TEXT,
+        description TEXT,
+
+        installs TEXT,
+        installs_min BIGINT,
+        installs_real BIGINT,
+
+        score NUMERIC(4,2),
+        ratings BIGINT,
+        reviews_count BIGINT,
+        histogram JSONB,
+
+        price NUMERIC(12,2),
+        free BOOLEAN,
+        iap BOOLEAN,
+
+        genre TEXT,
+        genre_id TEXT,
+        content_rating TEXT,
+
+        released DATE,
+        updated TIMESTAMPTZ,
+        version TEXT,
+
+        url TEXT,
+        icon TEXT,
+        header_image TEXT,
+        screenshots JSONB,
+        video TEXT,
+
+        last_scraped TIMESTAMPTZ DEFAULT NOW(),
+
+        PRIMARY KEY (app_id, lang, country)
+    );
+    """,
+
+    # 11) app_meta_history — узкий временной ряд метрик; строка пишется только при их изменении
+    """
+    CREATE TABLE IF NOT EXISTS app_meta_history (
+        id BIGSERIAL PRIMARY KEY,
+        app_id VARCHAR(255) NOT NULL REFERENCES app_meta_info(app_id) ON DELETE CASCADE,
+        lang VARCHAR(10) NOT NULL,
+        country VARCHAR(10) NOT NULL,
+        captured_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+
+        score NUMERIC(4,2),
+        ratings BIGINT,
+        installs_real BIGINT,
+        reviews_count BIGINT,
+        histogram JSONB
+    );
+    """,
+
+    # 12) llm_blob — промпты и сырые ответы LLM, адресуемые по sha256 и сжатые zlib
+    """
+    CREATE TABLE IF NOT EXISTS llm_blob (
+        hash CHAR(64) PRIMARY KEY,
+        kind VARCHAR(20) NOT NULL,
+        body BYTEA NOT NULL,
+        size_bytes INT NOT NULL,
+        stored_bytes INT NOT NULL,
+        created_at TIMESTAMPTZ DEFAULT NOW()
+    );
+    """,
+    # Уже сжато на клиенте — повторное сжатие pglz только тратит CPU
+    """
+    ALTER TABLE llm_blob ALTER COLUMN body SET STORAGE EXTERNAL;
+    """,
+
+    # 13) latest_analysis — указатель на последний анализ по ключу; '' в scenario/client_id = «любой»
+    """
+    CREATE TABLE IF NOT EXISTS latest_analysis (
+        app_id VARCHAR(255) NOT NULL REFERENCES app_meta_info(app_id) ON DELETE CASCADE,
+        lang VARCHAR(10) NOT NULL,
+        country VARCHAR(10) NOT NULL,
+        scenario TEXT NOT NULL,
+        client_id TEXT NOT NULL,
+
+        analysis_id UUID NOT NULL REFERENCES app_analysis(id) ON DELETE CASCADE,
+        analyzed_at TIMESTAMPTZ NOT NULL,
+
+        PRIMARY KEY (app_id, lang, country, scenario, client_id)
+    );
+    """,
+
+    # 14) app_review_cursor — курсор инкрементального скрейпа: граница сверху (hwm) двигается только
+    #     после полного прохода, недочитанный хвост докачивается по gap_token до gap_until_*
+    """
+    CREATE TABLE IF NOT EXISTS app_review_cursor (
+        app_id VARCHAR(255) NOT NULL REFERENCES app_meta_info(app_id) ON DELETE CASCADE,
+        lang VARCHAR(10) NOT NULL,
+        country VARCHAR(10) NOT NULL,
+
+        hwm_review_id TEXT,
+        hwm_date TIMESTAMPTZ,
+        gap_token JSONB,
+        gap_until_review_id TEXT,
+        gap_until_date TIMESTAMPTZ,
+
+        updated_at TIMESTAMPTZ DEFAULT NOW(),
+
+        PRIMARY KEY (app_id, lang, country)
+    );
+    """,
+
+    # Миграции существующих таблиц
+    """
+    ALTER TABLE app_meta_info ADD COLUMN IF NOT EXISTS refresh_tier SMALLINT NOT NULL DEFAULT 1;
+    """,
+    """
+    ALTER TABLE app_analysis ADD COLUMN IF NOT EXISTS input_fingerprint JSONB;
+    """,
+    """
+    ALTER TABLE app_analysis ADD COLUMN IF NOT EXISTS revalidated_at TIMESTAMPTZ;
+    """,
+    """
+    ALTER TABLE app_analysis ADD COLUMN IF NOT EXISTS prompt_tokens_est INT;
+    """,
+    """
+    ALTER TABLE analysis_jobs ADD COLUMN IF NOT EXISTS progress JSONB;
+    """,
+    # Старые строки считаем локалью по умолчанию (SCRAPE_LANG/SCRAPE_COUNTRY, как DEFAULT_* в db.py)
+    """
+    ALTER TABLE app_reviews
+        ADD COLUMN IF NOT EXISTS lang VARCHAR(10) NOT NULL DEFAULT {default_lang},
+        ADD COLUMN IF NOT EXISTS country VARCHAR(10) NOT NULL DEFAULT {default_country};
+    """,
+    """
+    ALTER TABLE app_analysis
+        ADD COLUMN IF NOT EXISTS lang VARCHAR(10) NOT NULL DEFAULT {default_lang},
+        ADD COLUMN IF NOT EXISTS country VARCHAR(10) NOT NULL DEFAULT {default_country};
+    """,
+    """
+    INSERT INTO app_meta_locale (
+        app_id, lang, country, developer_key,
+        title, summary, description,
+        installs, installs_min, installs_real,
+        score, ratings, reviews_count, histogram,
+        price, free, iap,
+        genre, genre_id, content_rating,
+        released, updated, version,
+        url, icon, header_image, screenshots, video,
+        last_scraped
+    )
+    SELECT app_id, {default_lang}, {default_country}, developer_key,
+           title, summary, description,
+           installs, installs_min, installs_real,
+           score, ratings, reviews_count, histogram,
+           price, free, iap,
+           genre, genre_id, content_rating,
+           released, updated, version,
+           url, icon, header_image, screenshots, video,
+           last_scraped
+    FROM app_meta_info
+    WHERE last_scraped IS NOT NULL
+    ON CONFLICT (app_id, lang, country) DO NOTHING;
+    """,
+
+    # Ссылки на llm_blob вместо полного prompt_used / raw_llm_response в каждой строке
+    """
+    ALTER TABLE app_analysis
+        ADD COLUMN IF NOT EXISTS prompt_hash CHAR(64),
+        ADD COLUMN IF NOT EXISTS raw_hash CHAR(64);
+    """,
+
+    # Первичное заполнение latest_analysis из истории (только пока таблица пустая)
+    """
+    INSERT INTO latest_analysis (app_id, lang, country, scenario, client_id, analysis_id, analyzed_at)
+    SELECT DISTINCT ON (a.app_id, a.lang, a.country, k.scenario, k.client_id)
+           a.app_id, a.lang, a.country, k.scenario, k.client_id, a.id, a.analyzed_at
+    FROM app_analysis a
+    CROSS JOIN LATERAL (
+        VALUES
+            (COALESCE(a.scenario, ''), COALESCE(a.client_id, '')),
+            (COALESCE(a.scenario, ''), ''),
+            ('', COALESCE(a.client_id, '')),
+            ('', '')
+    ) AS k(scenario, client_id)
+    WHERE a.analyzed_at IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM latest_analysis)
+    ORDER BY a.app_id, a.lang, a.country, k.scenario, k.client_id, a.analyzed_at DESC
+    ON CONFLICT DO NOTHING;
+    """,
+
+    # Хэши для пропуска записи неизменившейся меты
+    """
+    ALTER TABLE app_meta_info ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+    """,
+    """
+    ALTER TABLE app_meta_locale
+        ADD COLUMN IF NOT EXISTS content_hash CHAR(64),
+        ADD COLUMN IF NOT EXISTS metrics_hash CHAR(64);
+    """,
+    # Растёт при каждой вставке отзывов локали; ключ кэша review_analytics
+    """
+    ALTER TABLE app_meta_locale ADD COLUMN IF NOT EXISTS reviews_version BIGINT NOT NULL DEFAULT 0;
+    """,
+
     # Индексы (ускоряют кэш/историю)
     """
     CREATE INDEX IF NOT EXISTS idx_app_meta_dev ON app_meta_info(developer_key);
     """,
     """
+    CREATE INDEX IF NOT EXISTS idx_app_meta_last_scraped ON app_meta_info(last_scraped NULLS FIRST);
+    """,
+    """
     CREATE INDEX IF NOT EXISTS idx_reviews_app_date ON app_reviews(app_id, date DESC);
     """,
+    # Уникальность должна включать ключ секционирования и локаль (один отзыв виден в нескольких
+    # локалях); на большой старой таблице индекс заранее строит partition_reviews.py (CONCURRENTLY)
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_reviews_app_locale_review_date
+        ON app_reviews(app_id, lang, country, review_id, date);
+    """,
+    # Старые ключи без локали отбрасывали копии отзыва во второй локали
+    """
+    ALTER TABLE app_reviews DROP CONSTRAINT IF EXISTS app_reviews_app_id_review_id_key;
+    """,
+    """
+    DROP INDEX IF EXISTS idx_reviews_app_review_date;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_reviews_date_brin ON app_reviews USING BRIN (date);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_llm_cache_last_hit ON llm_response_cache(last_hit_at);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON analysis_jobs(status, created_at);
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_dedupe ON analysis_jobs(dedupe_key)
+        WHERE status IN ('queued', 'running');
+    """,
     """
     CREATE INDEX IF NOT EXISTS idx_analysis_app_date ON app_analysis(app_id, analyzed_at DESC);
     """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_meta_history_app_locale ON app_meta_history(app_id, lang, country, captured_at DESC);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_reviews_app_locale_date ON app_reviews(app_id, lang, country, date DESC);
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_analysis_app_locale_date ON app_analysis(app_id, lang, country, analyzed_at DESC);
+    """,
 ]
 
 def main():
@@ -159,7 +485,12 @@ def main():
     with psycopg.connect(DATABASE_URL) as conn:
         with conn.cursor() as cur:
             for stmt in DDL:
-                cur.execute(stmt)
+                cur.execute(
+                    sql.SQL(stmt).format(
+                        default_lang=sql.Literal(DEFAULT_LANG),
+                        default_country=sql.Literal(DEFAULT_COUNTRY),
+                    )
+                )
         conn.commit()
     print("✅ Done: tables + indexes created.")
 
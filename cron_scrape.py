@@ -1,23 +1,232 @@
+import math
 import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from typing import Any
 
-from pipeline import run_cron_refresh
+from config import get_env, get_env_int
+from db import Database, new_lease_owner
+from llm_cache import get_response_cache
+from pipeline import REFRESH_LEASE_SEC, parse_locales, reanalyze_apps, run_batch_pipeline, run_cron_refresh
+from scraper_google_play import GPLAY_LIMITER
 
 
-def main() -> None:
-    app_ids_raw = os.getenv("PORTFOLIO_APP_IDS", "")
-    app_ids = [x.strip() for x in app_ids_raw.split(",") if x.strip()]
+CRON_MODE = get_env("CRON_MODE", "portfolio")
+CRON_WORKERS = get_env_int("CRON_WORKERS", 4)
+CRON_TIME_BUDGET_SEC = get_env_int("CRON_TIME_BUDGET_SEC", 1800)
+CRON_REQUEST_BUDGET = get_env_int("CRON_REQUEST_BUDGET", 2000)
+CRON_BATCH_LIMIT = get_env_int("CRON_BATCH_LIMIT", 500)
+CRON_ERROR_BACKOFF_SEC = get_env_int("CRON_ERROR_BACKOFF_SEC", 3600)
+CRON_TIER_MAX_AGE_HOURS = [
+    int(x) for x in (get_env("CRON_TIER_MAX_AGE_HOURS", "24,168,720") or "").split(",") if x.strip()
+] or [168]
+
+
+def _parse_app_ids(name: str) -> list[str]:
+    app_ids_raw = os.getenv(name, "")
+    return [x.strip() for x in app_ids_raw.split(",") if x.strip()]
+
+
+def _refresh_one(
+    app_id: str,
+    *,
+    locales: list[tuple[str, str]],
+    check_fresh: bool = True,
+    lease_owner: str | None = None,
+) -> dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        r = run_cron_refresh(
+            app_id=app_id,
+            locales=locales,
+            check_fresh=check_fresh,
+            lease_owner=lease_owner,
+        )
+    except Exception as e:  # noqa: BLE001
+        r = {"app_id": app_id, "status": "error", "error": str(e)}
+    if lease_owner is not None:
+        try:
+            # last_scraped после ошибки не сдвинулся: снятая аренда вернула бы приложение в следующий claim
+            if r.get("status") == "error":
+                Database().defer_app_lease(app_id=app_id, owner=lease_owner, delay_sec=CRON_ERROR_BACKOFF_SEC)
+            else:
+                Database().release_app_lease(app_id=app_id, owner=lease_owner)
+        except Exception as e:  # noqa: BLE001
+            # Не отпущенная аренда сама истечёт, но ошибку не прячем: результат печатает вызывающий
+            r["lease_error"] = str(e)
+    r["elapsed_sec"] = round(time.perf_counter() - started, 3)
+    return r
+
+
+def _percentile(values: list[float], pct: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def summarize(results: list[dict[str, Any]], *, elapsed_sec: float, workers: int) -> dict[str, Any]:
+    latencies = [r["elapsed_sec"] for r in results if "elapsed_sec" in r]
+    statuses = Counter(r.get("status") for r in results)
+    return {
+        "summary": True,
+        "apps": len(results),
+        "workers": workers,
+        "elapsed_sec": round(elapsed_sec, 3),
+        "apps_per_min": round(len(results) / elapsed_sec * 60, 2) if elapsed_sec > 0 else None,
+        "p50_sec": _percentile(latencies, 50),
+        "p95_sec": _percentile(latencies, 95),
+        "errors": statuses.get("error", 0),
+        "statuses": dict(statuses),
+    }
+
+
+def run_portfolio(*, locales: list[tuple[str, str]], workers: int) -> list[dict[str, Any]]:
+    app_ids = _parse_app_ids("PORTFOLIO_APP_IDS")
     if not app_ids:
         raise RuntimeError("PORTFOLIO_APP_IDS is empty. Provide comma-separated app ids")
 
+    results: list[dict[str, Any]] = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_refresh_one, app_id, locales=locales) for app_id in app_ids]
+        for future in as_completed(futures):
+            r = future.result()
+            results.append(r)
+            print(r)
+    return results
+
+
+def run_scheduler(*, locales: list[tuple[str, str]], workers: int) -> list[dict[str, Any]]:
+    db = Database()
+    owner = new_lease_owner()
+
+    hot_app_ids = _parse_app_ids("PORTFOLIO_HOT_APP_IDS")
+    if hot_app_ids:
+        db.set_refresh_tier(app_ids=hot_app_ids, tier=0)
+
+    seed_app_ids = list(dict.fromkeys(_parse_app_ids("PORTFOLIO_APP_IDS") + hot_app_ids))
+    queue: list[str] = []
+    if seed_app_ids:
+        unknown = db.list_unknown_apps(app_ids=seed_app_ids)
+        if unknown:
+            queue = db.claim_apps(owner=owner, app_ids=unknown, lease_seconds=REFRESH_LEASE_SEC)
+    queue.reverse()
+
+    deadline = time.monotonic() + CRON_TIME_BUDGET_SEC
+    requests_at_start = GPLAY_LIMITER.acquired
+
+    def _within_budget() -> bool:
+        if time.monotonic() >= deadline:
+            return False
+        return GPLAY_LIMITER.acquired - requests_at_start < CRON_REQUEST_BUDGET
+
+    results: list[dict[str, Any]] = []
+    in_flight: set[Future] = set()
+    # Приложение, у которого не обновилась какая-то из локалей, остаётся самым старым;
+    # повторно за прогон не берём, аренду держим до конца прогона
+    attempted: set[str] = set()
+    repeated: list[str] = []
+    exhausted = False
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            while len(in_flight) < workers and _within_budget():
+                if not queue and not exhausted:
+                    queue = db.claim_stale_apps(
+                        owner=owner,
+                        tier_max_age_hours=CRON_TIER_MAX_AGE_HOURS,
+                        limit=min(CRON_BATCH_LIMIT, workers),
+                        lease_seconds=REFRESH_LEASE_SEC,
+                        locales=locales,
+                    )
+                    queue.reverse()
+                    exhausted = not queue
+                if not queue:
+                    break
+                app_id = queue.pop()
+                if app_id in attempted:
+                    repeated.append(app_id)
+                    continue
+                attempted.add(app_id)
+                in_flight.add(
+                    executor.submit(
+                        _refresh_one,
+                        app_id,
+                        locales=locales,
+                        check_fresh=False,
+                        lease_owner=owner,
+                    )
+                )
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                r = future.result()
+                results.append(r)
+                print(r)
+
+    for app_id in queue + repeated:
+        db.release_app_lease(app_id=app_id, owner=owner)
+    if not exhausted or queue:
+        print({"scheduler": "budget_exhausted", "deferred_apps": len(queue)})
+    return results
+
+
+def run_reanalysis() -> list[dict[str, Any]]:
+    app_ids = _parse_app_ids("PORTFOLIO_APP_IDS")
+    if not app_ids:
+        raise RuntimeError("PORTFOLIO_APP_IDS is empty. Provide comma-separated app ids")
+
+    results = reanalyze_apps(app_ids=app_ids, scenario=os.getenv("REANALYZE_SCENARIO", "default"))
+    for r in results:
+        print(r)
+
+    cache = get_response_cache()
+    if cache is not None:
+        print({"llm_cache": cache.stats()})
+    return results
+
+
+def run_batch_analysis(*, lang: str, country: str) -> list[dict[str, Any]]:
+    app_ids = _parse_app_ids("PORTFOLIO_APP_IDS")
+    if not app_ids:
+        raise RuntimeError("PORTFOLIO_APP_IDS is empty. Provide comma-separated app ids")
+
+    results = run_batch_pipeline(
+        app_ids=app_ids,
+        scenario=os.getenv("REANALYZE_SCENARIO", "default"),
+        lang=lang,
+        country=country,
+    )
+    for r in results:
+        print(r)
+
+    cache = get_response_cache()
+    if cache is not None:
+        print({"llm_cache": cache.stats()})
+    return results
+
+
+def main() -> None:
     lang = os.getenv("SCRAPE_LANG", "en")
     country = os.getenv("SCRAPE_COUNTRY", "us")
+    workers = max(1, CRON_WORKERS)
+    locales = parse_locales(os.getenv("SCRAPE_LOCALES")) or [(lang, country)]
 
-    for app_id in app_ids:
-        try:
-            r = run_cron_refresh(app_id=app_id, lang=lang, country=country)
-            print(r)
-        except Exception as e:  # noqa: BLE001
-            print({"app_id": app_id, "status": "error", "error": str(e)})
+    started = time.perf_counter()
+    if CRON_MODE == "scheduler":
+        results = run_scheduler(locales=locales, workers=workers)
+    elif CRON_MODE == "reanalyze":
+        results = run_reanalysis()
+    elif CRON_MODE == "batch":
+        results = run_batch_analysis(lang=lang, country=country)
+    else:
+        results = run_portfolio(locales=locales, workers=workers)
+
+    print(summarize(results, elapsed_sec=time.perf_counter() - started, workers=workers))
+    db = Database()
+    print({"pool": db.pool_stats(), "read_cache": db.read_cache_stats()})
 
 
 if __name__ == "__main__":
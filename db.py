@@ -1,10 +1,99 @@
+import atexit
+import hashlib
 import json
 import os
-from dataclasses import dataclass
-from datetime import datetime, timezone, timedelta
-from typing import Any, Iterable
+import socket
+import threading
+import time
+import uuid
+import zlib
+from contextlib import AbstractContextManager, contextmanager
+from dataclasses import dataclass, replace
+from datetime import date, datetime, timezone, timedelta
+from typing import Any, Iterable, Iterator
 
 import psycopg
+from psycopg.sql import SQL, Identifier, Literal
+from psycopg_pool import ConnectionPool
+
+from cache import TTLCache
+from config import get_env, get_env_float, get_env_int
+
+
+DB_POOL_MIN_SIZE = get_env_int("DB_POOL_MIN_SIZE", 1)
+DB_POOL_MAX_SIZE = get_env_int("DB_POOL_MAX_SIZE", 10)
+DB_POOL_TIMEOUT = get_env_float("DB_POOL_TIMEOUT", 30.0)
+DB_POOL_MAX_LIFETIME = get_env_float("DB_POOL_MAX_LIFETIME", 1800.0)
+DB_POOL_MAX_IDLE = get_env_float("DB_POOL_MAX_IDLE", 300.0)
+LLM_BLOB_COMPRESSION_LEVEL = get_env_int("LLM_BLOB_COMPRESSION_LEVEL", 6)
+DB_READ_CACHE_ENTRIES = get_env_int("DB_READ_CACHE_ENTRIES", 1024)
+DB_READ_CACHE_TTL_SEC = get_env_float("DB_READ_CACHE_TTL_SEC", 60.0)
+DB_ADVISORY_LOCK_MAX_CONN = get_env_int("DB_ADVISORY_LOCK_MAX_CONN", 8)
+
+# Локаль, данные которой зеркалятся в app_meta_info (по ней работает планировщик cron)
+DEFAULT_LANG = get_env("SCRAPE_LANG", "en")
+DEFAULT_COUNTRY = get_env("SCRAPE_COUNTRY", "us")
+
+_POOLS: dict[str, ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+# (база, родитель, секция) — только после коммита транзакции, в которой секция проверена или создана
+_KNOWN_REVIEW_PARTITIONS: set[tuple[str, str, str]] = set()
+
+# Соединения advisory_lock открываются вне пула — их число на процесс ограничиваем отдельно
+_ADVISORY_LOCK_SLOTS = threading.BoundedSemaphore(max(1, DB_ADVISORY_LOCK_MAX_CONN))
+
+# Кэш чтений get_meta_info / get_latest_analysis, общий для всех Database процесса.
+# Ключи: ("meta" | "analysis", database_url, app_id, lang, country, ...)
+_READ_CACHE = (
+    TTLCache(max_entries=DB_READ_CACHE_ENTRIES, ttl_sec=DB_READ_CACHE_TTL_SEC) if DB_READ_CACHE_ENTRIES > 0 else None
+)
+
+
+def _read_cache_ttl(fresh_since: datetime | None, max_age: timedelta) -> float:
+    # Запись не должна пережить окно свежести строки: после него нужно снова смотреть в БД
+    if fresh_since is None:
+        return 0.0
+    return min(DB_READ_CACHE_TTL_SEC, (fresh_since + max_age - utcnow()).total_seconds())
+
+
+def _invalidate_locale(kind: str, database_url: str, app_id: str, lang: str, country: str) -> None:
+    if _READ_CACHE is not None:
+        prefix = (kind, database_url, app_id, lang, country)
+        _READ_CACHE.invalidate_where(lambda key: key[:5] == prefix)
+
+
+def get_pool(database_url: str) -> ConnectionPool:
+    with _POOLS_LOCK:
+        pool = _POOLS.get(database_url)
+        if pool is None:
+            pool = ConnectionPool(
+                database_url,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=max(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE),
+                timeout=DB_POOL_TIMEOUT,
+                max_lifetime=DB_POOL_MAX_LIFETIME,
+                max_idle=DB_POOL_MAX_IDLE,
+                check=ConnectionPool.check_connection,
+                name="app_analyzer",
+                open=True,
+            )
+            _POOLS[database_url] = pool
+        return pool
+
+
+def close_pools() -> None:
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
+        _POOLS.clear()
+
+
+atexit.register(close_pools)
+
+
+def new_lease_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
 
 
 def utcnow() -> datetime:
@@ -50,6 +139,18 @@ class MetaInfo:
     screenshots: list[str] | None
     video: str | None
     last_scraped: datetime | None
+    lang: str = DEFAULT_LANG
+    country: str = DEFAULT_COUNTRY
+
+
+@dataclass
+class MetaSnapshot:
+    captured_at: datetime
+    score: float | None
+    ratings: int | None
+    installs_real: int | None
+    reviews_count: int | None
+    histogram: Any
 
 
 @dataclass
@@ -64,6 +165,588 @@ class AnalysisRow:
     recommendations: Any
     raw_llm_response: Any
     analyzed_at: datetime
+    input_fingerprint: dict[str, Any] | None = None
+    revalidated_at: datetime | None = None
+    prompt_hash: str | None = None
+
+    @property
+    def fresh_since(self) -> datetime:
+        return self.revalidated_at or self.analyzed_at
+
+
+_UPSERT_DEVELOPER_SQL = """
+    INSERT INTO app_developer (developer_key, name, email, website, address, last_scraped)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT (developer_key) DO UPDATE SET
+        name = EXCLUDED.name,
+        email = EXCLUDED.email,
+        website = EXCLUDED.website,
+        address = EXCLUDED.address,
+        last_scraped = EXCLUDED.last_scraped
+"""
+
+_UPSERT_META_SQL = """
+    INSERT INTO app_meta_info (
+        app_id, developer_key,
+        title, summary, description,
+        installs, installs_min, installs_real,
+        score, ratings, reviews_count, histogram,
+        price, free, iap,
+        genre, genre_id, content_rating,
+        released, updated, version,
+        url, icon, header_image, screenshots, video,
+        last_scraped, content_hash
+    ) VALUES (
+        %s, %s,
+        %s, %s, %s,
+        %s, %s, %s,
+        %s, %s, %s, %s,
+        %s, %s, %s,
+        %s, %s, %s,
+        %s, %s, %s,
+        %s, %s, %s, %s, %s,
+        %s, %s
+    )
+    ON CONFLICT (app_id) DO UPDATE SET
+        developer_key = EXCLUDED.developer_key,
+        title = EXCLUDED.title,
+        summary = EXCLUDED.summary,
+        description = EXCLUDED.description,
+        installs = EXCLUDED.installs,
+        installs_min = EXCLUDED.installs_min,
+        installs_real = EXCLUDED.installs_real,
+        score = EXCLUDED.score,
+        ratings = EXCLUDED.ratings,
+        reviews_count = EXCLUDED.reviews_count,
+        histogram = EXCLUDED.histogram,
+        price = EXCLUDED.price,
+        free = EXCLUDED.free,
+        iap = EXCLUDED.iap,
+        genre = EXCLUDED.genre,
+        genre_id = EXCLUDED.genre_id,
+        content_rating = EXCLUDED.content_rating,
+        released = EXCLUDED.released,
+        updated = EXCLUDED.updated,
+        version = EXCLUDED.version,
+        url = EXCLUDED.url,
+        icon = EXCLUDED.icon,
+        header_image = EXCLUDED.header_image,
+        screenshots = EXCLUDED.screenshots,
+        video = EXCLUDED.video,
+        last_scraped = EXCLUDED.last_scraped,
+        content_hash = EXCLUDED.content_hash
+    WHERE app_meta_info.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+"""
+
+# Мета не изменилась — трогаем только last_scraped, без перезаписи description/screenshots
+_TOUCH_META_SQL = """
+    UPDATE app_meta_info SET last_scraped = %s
+    WHERE app_id = %s AND content_hash = %s
+"""
+
+_INSERT_META_ANCHOR_SQL = """
+    INSERT INTO app_meta_info (app_id, developer_key, title, last_scraped)
+    VALUES (%s, %s, %s, NULL)
+    ON CONFLICT (app_id) DO NOTHING
+"""
+
+_UPSERT_META_LOCALE_SQL = """
+    INSERT INTO app_meta_locale (
+        app_id, lang, country, developer_key,
+        title, summary, description,
+        installs, installs_min, installs_real,
+        score, ratings, reviews_count, histogram,
+        price, free, iap,
+        genre, genre_id, content_rating,
+        released, updated, version,
+        url, icon, header_image, screenshots, video,
+        last_scraped, content_hash, metrics_hash
+    ) VALUES (
+        %s, %s, %s, %s,
+        %s, %s, %s,
+        %s, %s, %s,
+        %s, %s, %s, %s,
+        %s, %s, %s,
+        %s, %s, %s,
+        %s, %s, %s,
+        %s, %s, %s, %s, %s,
+        %s, %s, %s
+    )
+    ON CONFLICT (app_id, lang, country) DO UPDATE SET
+        developer_key = EXCLUDED.developer_key,
+        title = EXCLUDED.title,
+        summary = EXCLUDED.summary,
+        description = EXCLUDED.description,
+        installs = EXCLUDED.installs,
+        installs_min = EXCLUDED.installs_min,
+        installs_real = EXCLUDED.installs_real,
+        score = EXCLUDED.score,
+        ratings = EXCLUDED.ratings,
+        reviews_count = EXCLUDED.reviews_count,
+        histogram = EXCLUDED.histogram,
+        price = EXCLUDED.price,
+        free = EXCLUDED.free,
+        iap = EXCLUDED.iap,
+        genre = EXCLUDED.genre,
+        genre_id = EXCLUDED.genre_id,
+        content_rating = EXCLUDED.content_rating,
+        released = EXCLUDED.released,
+        updated = EXCLUDED.updated,
+        version = EXCLUDED.version,
+        url = EXCLUDED.url,
+        icon = EXCLUDED.icon,
+        header_image = EXCLUDED.header_image,
+        screenshots = EXCLUDED.screenshots,
+        video = EXCLUDED.video,
+        last_scraped = EXCLUDED.last_scraped,
+        content_hash = EXCLUDED.content_hash,
+        metrics_hash = EXCLUDED.metrics_hash
+    WHERE app_meta_locale.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+"""
+
+_TOUCH_META_LOCALE_SQL = """
+    UPDATE app_meta_locale SET last_scraped = %s
+    WHERE app_id = %s AND lang = %s AND country = %s AND content_hash = %s
+"""
+
+# Должен выполняться до upsert локали: сравнивает с metrics_hash предыдущего скрейпа
+_INSERT_META_HISTORY_SQL = """
+    INSERT INTO app_meta_history (
+        app_id, lang, country, captured_at,
+        score, ratings, installs_real, reviews_count, histogram
+    )
+    SELECT %s, %s, %s, %s, %s, %s, %s, %s, %s::jsonb
+    WHERE NOT EXISTS (
+        SELECT 1 FROM app_meta_locale
+        WHERE app_id = %s AND lang = %s AND country = %s AND metrics_hash = %s
+    )
+"""
+
+_CREATE_REVIEWS_STAGE_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS app_reviews_stage (
+        review_id TEXT,
+        user_name TEXT,
+        user_image TEXT,
+        content TEXT,
+        score INT,
+        thumbs_up BIGINT,
+        version TEXT,
+        date TIMESTAMPTZ,
+        replied_at TIMESTAMPTZ,
+        reply_content TEXT
+    ) ON COMMIT DELETE ROWS
+"""
+
+_COPY_REVIEWS_STAGE_SQL = """
+    COPY app_reviews_stage (
+        review_id, user_name, user_image,
+        content, score, thumbs_up,
+        version, date,
+        replied_at, reply_content
+    ) FROM STDIN
+"""
+
+# Счётчик вставок отзывов локали: по нему кэши производных от отзывов (review_analytics)
+# видят вставки из любого процесса за один поиск по первичному ключу
+_BUMP_REVIEWS_VERSION_SQL = """
+    UPDATE app_meta_locale SET reviews_version = reviews_version + 1
+    WHERE app_id = %s AND lang = %s AND country = %s
+"""
+
+_REVIEW_STAGE_MONTHS_SQL = """
+    SELECT DISTINCT date_trunc('month', date AT TIME ZONE 'UTC')::date
+    FROM app_reviews_stage
+    WHERE date IS NOT NULL
+"""
+
+# Google Play меняет дату отзыва при редактировании: старую версию удаляем, новая вставится ниже.
+# Иначе на старой схеме UNIQUE (app_id, review_id) откатывает всю единицу работы,
+# а на секционированной отзыв хранится дважды.
+_DELETE_EDITED_REVIEWS_SQL = """
+    DELETE FROM app_reviews r
+    USING app_reviews_stage s
+    WHERE r.app_id = %s AND r.lang = %s AND r.country = %s
+      AND r.review_id = s.review_id
+      AND s.date IS NOT NULL
+      AND r.date IS DISTINCT FROM s.date
+"""
+
+_MERGE_REVIEWS_STAGE_SQL = """
+    WITH staged AS (
+        DELETE FROM app_reviews_stage
+        RETURNING *
+    ),
+    latest AS (
+        SELECT DISTINCT ON (review_id) *
+        FROM staged
+        WHERE date IS NOT NULL
+        ORDER BY review_id, date DESC
+    )
+    INSERT INTO app_reviews (
+        app_id, lang, country, review_id, user_name, user_image,
+        content, score, thumbs_up,
+        version, date,
+        replied_at, reply_content
+    )
+    SELECT %s, %s, %s, review_id, user_name, user_image,
+           content, score, thumbs_up,
+           version, date,
+           replied_at, reply_content
+    FROM latest
+    ON CONFLICT (app_id, lang, country, review_id, date) DO NOTHING
+"""
+
+_UPSERT_BACKFILL_CHECKPOINT_SQL = """
+    INSERT INTO app_review_backfill (
+        app_id, lang, country,
+        continuation_token, pages, reviews_seen, reviews_inserted,
+        status, updated_at
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (app_id, lang, country) DO UPDATE SET
+        continuation_token = EXCLUDED.continuation_token,
+        pages = EXCLUDED.pages,
+        reviews_seen = EXCLUDED.reviews_seen,
+        reviews_inserted = EXCLUDED.reviews_inserted,
+        status = EXCLUDED.status,
+        updated_at = EXCLUDED.updated_at
+"""
+
+_UPSERT_REVIEW_CURSOR_SQL = """
+    INSERT INTO app_review_cursor (
+        app_id, lang, country,
+        hwm_review_id, hwm_date,
+        gap_token, gap_until_review_id, gap_until_date,
+        updated_at
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW())
+    ON CONFLICT (app_id, lang, country) DO UPDATE SET
+        hwm_review_id = EXCLUDED.hwm_review_id,
+        hwm_date = EXCLUDED.hwm_date,
+        gap_token = EXCLUDED.gap_token,
+        gap_until_review_id = EXCLUDED.gap_until_review_id,
+        gap_until_date = EXCLUDED.gap_until_date,
+        updated_at = EXCLUDED.updated_at
+"""
+
+_INSERT_BLOB_SQL = """
+    INSERT INTO llm_blob (hash, kind, body, size_bytes, stored_bytes)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (hash) DO NOTHING
+"""
+
+# Одна вставка обновляет точный ключ и ключи-шаблоны ('' = любой), по которым ищет get_latest_analysis
+_UPSERT_LATEST_ANALYSIS_SQL = """
+    INSERT INTO latest_analysis (app_id, lang, country, scenario, client_id, analysis_id, analyzed_at)
+    SELECT %s, %s, %s, k.scenario, k.client_id, %s, %s
+    FROM unnest(%s::text[], %s::text[]) AS k(scenario, client_id)
+    ON CONFLICT (app_id, lang, country, scenario, client_id) DO UPDATE SET
+        analysis_id = EXCLUDED.analysis_id,
+        analyzed_at = EXCLUDED.analyzed_at
+    WHERE latest_analysis.analyzed_at <= EXCLUDED.analyzed_at
+"""
+
+_DELETE_PERMISSIONS_SQL = "DELETE FROM app_permissions WHERE app_id = %s"
+
+_INSERT_PERMISSION_SQL = """
+    INSERT INTO app_permissions (app_id, category, permissions)
+    VALUES (%s, %s, %s)
+"""
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    params: dict[str, Any]
+    status: str
+    result: Any
+    error: str | None
+    attempts: int
+    created_at: datetime | None
+    started_at: datetime | None
+    finished_at: datetime | None
+    progress: dict[str, Any] | None = None
+
+
+@dataclass
+class BackfillCheckpoint:
+    app_id: str
+    lang: str
+    country: str
+    continuation_token: dict[str, Any] | None
+    pages: int
+    reviews_seen: int
+    reviews_inserted: int
+    status: str
+    updated_at: datetime | None
+
+
+@dataclass
+class ReviewCursor:
+    app_id: str
+    lang: str
+    country: str
+    hwm_review_id: str | None
+    hwm_date: datetime | None
+    gap_token: dict[str, Any] | None
+    gap_until_review_id: str | None
+    gap_until_date: datetime | None
+
+
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return str(obj)
+
+
+def month_start(ts: datetime) -> date:
+    ts = ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+    ts = ts.astimezone(timezone.utc)
+    return date(ts.year, ts.month, 1)
+
+
+def next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def review_partition_name(month: date) -> str:
+    return f"app_reviews_y{month.year:04d}m{month.month:02d}"
+
+
+def _review_partition_key(conn: psycopg.Connection, parent: str, name: str) -> tuple[str, str, str]:
+    return (conn.info.dsn, parent, name)
+
+
+def ensure_review_partitions(
+    conn: psycopg.Connection,
+    months: Iterable[date],
+    *,
+    parent: str = "app_reviews",
+    verified: set[tuple[str, str, str]] | None = None,
+) -> list[str]:
+    # verified собирает проверенные секции; вызывающий переносит их в _KNOWN_REVIEW_PARTITIONS после коммита.
+    # Если запомнить раньше, откат оставит процесс с секцией, которой нет, и строки уйдут в default.
+    missing = sorted(
+        {
+            m
+            for m in months
+            if _review_partition_key(conn, parent, review_partition_name(m)) not in _KNOWN_REVIEW_PARTITIONS
+        }
+    )
+    if not missing:
+        return []
+
+    created: list[str] = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (parent,))
+        row = cur.fetchone()
+        if not row or row[0] != "p":
+            # Таблица ещё не перенесена в секционированную схему
+            return []
+
+        # CREATE TABLE ... PARTITION OF берёт сильную блокировку на родителя, поэтому
+        # сначала проверяем каталог, а создание сериализуем между воркерами
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('app_reviews_partitions'))")
+        for month in missing:
+            name = review_partition_name(month)
+            cur.execute("SELECT to_regclass(%s)", (name,))
+            if cur.fetchone()[0] is None:
+                cur.execute(
+                    SQL("CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})").format(
+                        Identifier(name),
+                        Identifier(parent),
+                        Literal(f"{month.isoformat()} 00:00:00+00"),
+                        Literal(f"{next_month(month).isoformat()} 00:00:00+00"),
+                    )
+                )
+                created.append(name)
+            if verified is not None:
+                verified.add(_review_partition_key(conn, parent, name))
+    return created
+
+
+def _content_hash(values: tuple[Any, ...]) -> str:
+    payload = json.dumps(values, default=_json_default, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def encode_blob(kind: str, value: Any) -> tuple[str, bytes, int]:
+    if kind == "prompt":
+        data = str(value).encode("utf-8")
+    else:
+        data = json.dumps(value, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    digest = hashlib.sha256(kind.encode("utf-8") + b"\0" + data).hexdigest()
+    return digest, zlib.compress(data, LLM_BLOB_COMPRESSION_LEVEL), len(data)
+
+
+def decode_blob(kind: str, body: bytes | None) -> Any:
+    if body is None:
+        return None
+    data = zlib.decompress(bytes(body)).decode("utf-8")
+    return data if kind == "prompt" else json.loads(data)
+
+
+def _json_param(value: Any) -> Any:
+    return json.dumps(value) if isinstance(value, (dict, list)) else value
+
+
+class UnitOfWork:
+    def __init__(self, conn: psycopg.Connection) -> None:
+        self.conn = conn
+        self._pending: list[tuple[str, tuple[Any, ...]]] = []
+        self.touched: set[tuple[str, str, str, str]] = set()
+        self.partitions: set[tuple[str, str, str]] = set()
+
+    def _queue(self, sql: str, params: tuple[Any, ...]) -> None:
+        self._pending.append((sql, params))
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        with self.conn.pipeline():
+            with self.conn.cursor() as cur:
+                for sql, params in pending:
+                    cur.execute(sql, params)
+
+    def upsert_developer(
+        self,
+        *,
+        developer_key: str,
+        name: str | None,
+        email: str | None,
+        website: str | None,
+        address: str | None,
+        scraped_at: datetime | None = None,
+    ) -> None:
+        scraped_at = scraped_at or utcnow()
+        self._queue(_UPSERT_DEVELOPER_SQL, (developer_key, name, email, website, address, scraped_at))
+
+    def upsert_meta_info(self, meta: MetaInfo, *, scraped_at: datetime | None = None) -> MetaInfo:
+        scraped_at = scraped_at or utcnow()
+        histogram = json.dumps(meta.histogram) if meta.histogram is not None else None
+        fields = (
+            meta.title,
+            meta.summary,
+            meta.description,
+            meta.installs,
+            meta.installs_min,
+            meta.installs_real,
+            meta.score,
+            meta.ratings,
+            meta.reviews_count,
+            histogram,
+            meta.price,
+            meta.free,
+            meta.iap,
+            meta.genre,
+            meta.genre_id,
+            meta.content_rating,
+            meta.released,
+            meta.updated,
+            meta.version,
+            meta.url,
+            meta.icon,
+            meta.header_image,
+            json.dumps(meta.screenshots) if meta.screenshots is not None else None,
+            meta.video,
+        )
+        content_hash = _content_hash((meta.developer_key, *fields))
+        metrics = (meta.score, meta.ratings, meta.installs_real, meta.reviews_count, histogram)
+        metrics_hash = _content_hash(metrics)
+        locale_key = (meta.app_id, meta.lang, meta.country)
+        self.touched.add(("meta", *locale_key))
+
+        if (meta.lang, meta.country) == (DEFAULT_LANG, DEFAULT_COUNTRY):
+            self._queue(_TOUCH_META_SQL, (scraped_at, meta.app_id, content_hash))
+            self._queue(_UPSERT_META_SQL, (meta.app_id, meta.developer_key, *fields, scraped_at, content_hash))
+        else:
+            # Другие локали не перезаписывают основную строку, а только гарантируют её наличие для FK
+            self._queue(_INSERT_META_ANCHOR_SQL, (meta.app_id, meta.developer_key, meta.title))
+        self._queue(_INSERT_META_HISTORY_SQL, (*locale_key, scraped_at, *metrics, *locale_key, metrics_hash))
+        self._queue(_TOUCH_META_LOCALE_SQL, (scraped_at, *locale_key, content_hash))
+        self._queue(
+            _UPSERT_META_LOCALE_SQL,
+            (*locale_key, meta.developer_key, *fields, scraped_at, content_hash, metrics_hash),
+        )
+        return replace(meta, last_scraped=scraped_at)
+
+    def put_blob(self, kind: str, value: Any) -> str:
+        blob_hash, body, size_bytes = encode_blob(kind, value)
+        self._queue(_INSERT_BLOB_SQL, (blob_hash, kind, body, size_bytes, len(body)))
+        return blob_hash
+
+    def replace_permissions(self, *, app_id: str, permissions: list[dict[str, Any]]) -> None:
+        self._queue(_DELETE_PERMISSIONS_SQL, (app_id,))
+        for p in permissions:
+            self._queue(_INSERT_PERMISSION_SQL, (app_id, p.get("category"), _json_param(p.get("permissions"))))
+
+    def save_backfill_checkpoint(self, checkpoint: BackfillCheckpoint) -> None:
+        self._queue(
+            _UPSERT_BACKFILL_CHECKPOINT_SQL,
+            (
+                checkpoint.app_id,
+                checkpoint.lang,
+                checkpoint.country,
+                _json_param(checkpoint.continuation_token),
+                checkpoint.pages,
+                checkpoint.reviews_seen,
+                checkpoint.reviews_inserted,
+                checkpoint.status,
+                checkpoint.updated_at or utcnow(),
+            ),
+        )
+
+    def save_review_cursor(self, cursor: ReviewCursor) -> None:
+        self._queue(
+            _UPSERT_REVIEW_CURSOR_SQL,
+            (
+                cursor.app_id,
+                cursor.lang,
+                cursor.country,
+                cursor.hwm_review_id,
+                cursor.hwm_date,
+                _json_param(cursor.gap_token),
+                cursor.gap_until_review_id,
+                cursor.gap_until_date,
+            ),
+        )
+
+    def insert_reviews(
+        self,
+        *,
+        app_id: str,
+        reviews: Iterable[dict[str, Any]],
+        lang: str = DEFAULT_LANG,
+        country: str = DEFAULT_COUNTRY,
+    ) -> int:
+        self.flush()
+        with self.conn.cursor() as cur:
+            cur.execute(_CREATE_REVIEWS_STAGE_SQL)
+            with cur.copy(_COPY_REVIEWS_STAGE_SQL) as copy:
+                for r in reviews:
+                    copy.write_row(
+                        (
+                            r.get("review_id"),
+                            r.get("user_name"),
+                            r.get("user_image"),
+                            r.get("content"),
+                            r.get("score"),
+                            r.get("thumbs_up"),
+                            r.get("version"),
+                            r.get("date"),
+                            r.get("replied_at"),
+                            r.get("reply_content"),
+                        )
+                    )
+            # Месяцы берём из stage, а не из reviews: генератор проходится один раз и не держится в памяти
+            cur.execute(_REVIEW_STAGE_MONTHS_SQL)
+            ensure_review_partitions(self.conn, [row[0] for row in cur.fetchall()], verified=self.partitions)
+            cur.execute(_DELETE_EDITED_REVIEWS_SQL, (app_id, lang, country))
+            cur.execute(_MERGE_REVIEWS_STAGE_SQL, (app_id, lang, country))
+            inserted = max(cur.rowcount, 0)
+            if inserted:
+                cur.execute(_BUMP_REVIEWS_VERSION_SQL, (app_id, lang, country))
+        return inserted
 
 
 class Database:
@@ -71,51 +754,72 @@ class Database:
         self.database_url = database_url or os.getenv("DATABASE_URL")
         if not self.database_url:
             raise RuntimeError("DATABASE_URL is not set")
+        self.pool = get_pool(self.database_url)
 
-    def connect(self) -> psycopg.Connection:
-        return psycopg.connect(self.database_url)
+    def connect(self) -> AbstractContextManager[psycopg.Connection]:
+        return self.pool.connection()
 
-    def get_latest_analysis(self, *, app_id: str, scenario: str | None, client_id: str | None) -> AnalysisRow | None:
-        where = ["app_id = %s"]
-        params: list[Any] = [app_id]
+    def pool_stats(self) -> dict[str, int]:
+        return self.pool.get_stats()
 
-        if scenario is not None and scenario != "":
-            where.append("scenario = %s")
-            params.append(scenario)
+    def read_cache_stats(self) -> dict[str, int] | None:
+        return _READ_CACHE.stats() if _READ_CACHE is not None else None
 
-        if client_id is not None and client_id != "":
-            where.append("client_id = %s")
-            params.append(client_id)
+    def get_latest_analysis(
+        self,
+        *,
+        app_id: str,
+        scenario: str | None,
+        client_id: str | None,
+        lang: str = DEFAULT_LANG,
+        country: str = DEFAULT_COUNTRY,
+        max_age: timedelta,
+    ) -> AnalysisRow | None:
+        cache_key = ("analysis", self.database_url, app_id, lang, country, scenario or "", client_id or "")
+        if _READ_CACHE is not None:
+            cached = _READ_CACHE.get(cache_key)
+            if cached is not None:
+                return cached
 
+        # Пустая строка в ключе latest_analysis означает «любой сценарий / любой клиент»
         sql = """
-            SELECT id, app_id, client_id, scenario, user_context, prompt_used,
-                   market_fit, recommendations, raw_llm_response, analyzed_at
-            FROM app_analysis
-            WHERE {where_clause}
-            ORDER BY analyzed_at DESC
-            LIMIT 1
-        """.format(where_clause=" AND ".join(where))
+            SELECT a.id, a.app_id, a.client_id, a.scenario, a.user_context, a.prompt_hash,
+                   a.market_fit, a.recommendations,
+                   CASE WHEN a.raw_hash IS NULL THEN a.raw_llm_response END, a.analyzed_at,
+                   a.input_fingerprint, a.revalidated_at, rb.body
+            FROM latest_analysis l
+            JOIN app_analysis a ON a.id = l.analysis_id
+            LEFT JOIN llm_blob rb ON rb.hash = a.raw_hash
+            WHERE l.app_id = %s AND l.lang = %s AND l.country = %s AND l.scenario = %s AND l.client_id = %s
+        """
+        params = (app_id, lang, country, scenario or "", client_id or "")
 
         with self.connect() as conn:
             with conn.cursor() as cur:
-                cur.execute(sql, tuple(params))
+                cur.execute(sql, params)
                 row = cur.fetchone()
                 if not row:
                     return None
 
         analyzed_at = parse_timestamptz(row[9]) or utcnow()
-        return AnalysisRow(
+        latest = AnalysisRow(
             id=str(row[0]),
             app_id=row[1],
             client_id=row[2],
             scenario=row[3],
             user_context=row[4],
-            prompt_used=row[5],
+            prompt_used=None,
             market_fit=row[6],
             recommendations=row[7],
-            raw_llm_response=row[8],
+            raw_llm_response=decode_blob("response", row[12]) if row[12] is not None else row[8],
             analyzed_at=analyzed_at,
+            input_fingerprint=row[10],
+            revalidated_at=parse_timestamptz(row[11]),
+            prompt_hash=row[5],
         )
+        if _READ_CACHE is not None:
+            _READ_CACHE.set(cache_key, latest, ttl_sec=_read_cache_ttl(latest.fresh_since, max_age))
+        return latest
 
     def insert_analysis(
         self,
@@ -128,31 +832,82 @@ class Database:
         market_fit: int | None,
         recommendations: Any,
         raw_llm_response: Any,
+        input_fingerprint: dict[str, Any] | None = None,
+        prompt_tokens_est: int | None = None,
+        lang: str = DEFAULT_LANG,
+        country: str = DEFAULT_COUNTRY,
     ) -> None:
         sql = """
             INSERT INTO app_analysis (
-                app_id, client_id, scenario, user_context, prompt_used,
-                market_fit, recommendations, raw_llm_response
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                id, app_id, lang, country, client_id, scenario, user_context,
+                market_fit, recommendations, input_fingerprint,
+                prompt_tokens_est, prompt_hash, raw_hash, analyzed_at
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
+        analysis_id = str(uuid.uuid4())
+        analyzed_at = utcnow()
+        # Сортировка — одинаковый порядок блокировок ключей у параллельных вставок
+        keys = sorted({(scenario or "", client_id or ""), (scenario or "", ""), ("", client_id or ""), ("", "")})
+        with self.unit_of_work() as uow:
+            prompt_hash = uow.put_blob("prompt", prompt_used or "")
+            raw_hash = uow.put_blob("response", raw_llm_response)
+            uow._queue(
+                sql,
+                (
+                    analysis_id,
+                    app_id,
+                    lang,
+                    country,
+                    client_id,
+                    scenario,
+                    user_context,
+                    market_fit,
+                    _json_param(recommendations),
+                    _json_param(input_fingerprint),
+                    prompt_tokens_est,
+                    prompt_hash,
+                    raw_hash,
+                    analyzed_at,
+                ),
+            )
+            uow._queue(
+                _UPSERT_LATEST_ANALYSIS_SQL,
+                (
+                    app_id,
+                    lang,
+                    country,
+                    analysis_id,
+                    analyzed_at,
+                    [k[0] for k in keys],
+                    [k[1] for k in keys],
+                ),
+            )
+            uow.touched.add(("analysis", app_id, lang, country))
+
+    def revalidate_analysis(self, *, analysis_id: str) -> None:
+        sql = "UPDATE app_analysis SET revalidated_at = NOW() WHERE id = %s RETURNING app_id, lang, country"
         with self.connect() as conn:
             with conn.cursor() as cur:
-                cur.execute(
-                    sql,
-                    (
-                        app_id,
-                        client_id,
-                        scenario,
-                        user_context,
-                        prompt_used,
-                        market_fit,
-                        json.dumps(recommendations) if isinstance(recommendations, (dict, list)) else recommendations,
-                        json.dumps(raw_llm_response) if isinstance(raw_llm_response, (dict, list)) else raw_llm_response,
-                    ),
-                )
+                cur.execute(sql, (analysis_id,))
+                row = cur.fetchone()
             conn.commit()
+        if row:
+            _invalidate_locale("analysis", self.database_url, *row)
+
+    def get_meta_info(
+        self,
+        *,
+        app_id: str,
+        lang: str = DEFAULT_LANG,
+        country: str = DEFAULT_COUNTRY,
+        max_age: timedelta,
+    ) -> MetaInfo | None:
+        cache_key = ("meta", self.database_url, app_id, lang, country)
+        if _READ_CACHE is not None:
+            cached = _READ_CACHE.get(cache_key)
+            if cached is not None:
+                return cached
 
-    def get_meta_info(self, *, app_id: str) -> MetaInfo | None:
         sql = """
             SELECT app_id, developer_key, title, summary, description,
                    installs, installs_min, installs_real,
@@ -162,17 +917,17 @@ class Database:
                    released, updated, version,
                    url, icon, header_image, screenshots, video,
                    last_scraped
-            FROM app_meta_info
-            WHERE app_id = %s
+            FROM app_meta_locale
+            WHERE app_id = %s AND lang = %s AND country = %s
         """
         with self.connect() as conn:
             with conn.cursor() as cur:
-                cur.execute(sql, (app_id,))
+                cur.execute(sql, (app_id, lang, country))
                 row = cur.fetchone()
                 if not row:
                     return None
 
-        return MetaInfo(
+        meta = MetaInfo(
             app_id=row[0],
             developer_key=row[1],
             title=row[2],
@@ -200,175 +955,626 @@ class Database:
             screenshots=row[24],
             video=row[25],
             last_scraped=parse_timestamptz(row[26]),
+            lang=lang,
+            country=country,
         )
+        if _READ_CACHE is not None:
+            _READ_CACHE.set(cache_key, meta, ttl_sec=_read_cache_ttl(meta.last_scraped, max_age))
+        return meta
 
-    def upsert_developer(
+    def get_meta_history(
         self,
         *,
-        developer_key: str,
-        name: str | None,
-        email: str | None,
-        website: str | None,
-        address: str | None,
-        scraped_at: datetime | None = None,
-    ) -> None:
-        scraped_at = scraped_at or utcnow()
+        app_id: str,
+        lang: str = DEFAULT_LANG,
+        country: str = DEFAULT_COUNTRY,
+        since: datetime | None = None,
+    ) -> list[MetaSnapshot]:
         sql = """
-            INSERT INTO app_developer (developer_key, name, email, website, address, last_scraped)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (developer_key) DO UPDATE SET
-                name = EXCLUDED.name,
-                email = EXCLUDED.email,
-                website = EXCLUDED.website,
-                address = EXCLUDED.address,
-                last_scraped = EXCLUDED.last_scraped
+            SELECT captured_at, score, ratings, installs_real, reviews_count, histogram
+            FROM app_meta_history
+            WHERE app_id = %s AND lang = %s AND country = %s AND captured_at >= %s
+            ORDER BY captured_at
         """
         with self.connect() as conn:
             with conn.cursor() as cur:
-                cur.execute(sql, (developer_key, name, email, website, address, scraped_at))
-            conn.commit()
+                cur.execute(sql, (app_id, lang, country, since or datetime.min.replace(tzinfo=timezone.utc)))
+                rows = cur.fetchall()
+        return [
+            MetaSnapshot(
+                captured_at=parse_timestamptz(row[0]) or utcnow(),
+                score=float(row[1]) if row[1] is not None else None,
+                ratings=row[2],
+                installs_real=row[3],
+                reviews_count=row[4],
+                histogram=row[5],
+            )
+            for row in rows
+        ]
 
-    def upsert_meta_info(self, meta: MetaInfo, *, scraped_at: datetime | None = None) -> None:
-        scraped_at = scraped_at or utcnow()
+    def claim_stale_apps(
+        self,
+        *,
+        owner: str,
+        tier_max_age_hours: list[int],
+        limit: int,
+        lease_seconds: int,
+        locales: list[tuple[str, str]],
+    ) -> list[str]:
+        # Свежесть — по самой старой из обновляемых локалей: app_meta_info.last_scraped пишет только
+        # локаль по умолчанию, а у приложения, пришедшего через другую локаль, там NULL навсегда.
+        # Нет строки локали — приложение устарело.
         sql = """
-            INSERT INTO app_meta_info (
-                app_id, developer_key,
-                title, summary, description,
-                installs, installs_min, installs_real,
-                score, ratings, reviews_count, histogram,
-                price, free, iap,
-                genre, genre_id, content_rating,
-                released, updated, version,
-                url, icon, header_image, screenshots, video,
-                last_scraped
-            ) VALUES (
-                %s, %s,
-                %s, %s, %s,
-                %s, %s, %s,
-                %s, %s, %s, %s,
-                %s, %s, %s,
-                %s, %s, %s,
-                %s, %s, %s,
-                %s, %s, %s, %s, %s,
-                %s
+            WITH candidates AS (
+                SELECT m.app_id, s.last_scraped
+                FROM app_meta_info m
+                CROSS JOIN LATERAL (
+                    SELECT CASE WHEN bool_and(ml.last_scraped IS NOT NULL) THEN MIN(ml.last_scraped) END
+                               AS last_scraped
+                    FROM unnest(%s::text[], %s::text[]) AS loc(lang, country)
+                    LEFT JOIN app_meta_locale ml
+                        ON ml.app_id = m.app_id AND ml.lang = loc.lang AND ml.country = loc.country
+                ) s
+                WHERE (
+                        s.last_scraped IS NULL
+                        OR s.last_scraped < NOW() - make_interval(
+                            hours => COALESCE((%s::int[])[m.refresh_tier + 1], %s)
+                        )
+                    )
+                  AND NOT EXISTS (
+                        SELECT 1 FROM app_refresh_lease l
+                        WHERE l.app_id = m.app_id AND l.leased_until > NOW()
+                    )
+                ORDER BY s.last_scraped NULLS FIRST
+                LIMIT %s
+                FOR NO KEY UPDATE OF m SKIP LOCKED
+            ),
+            claimed AS (
+                INSERT INTO app_refresh_lease (app_id, owner, leased_until, claimed_at)
+                SELECT app_id, %s, NOW() + make_interval(secs => %s), NOW()
+                FROM candidates
+                ON CONFLICT (app_id) DO UPDATE SET
+                    owner = EXCLUDED.owner,
+                    leased_until = EXCLUDED.leased_until,
+                    claimed_at = EXCLUDED.claimed_at
+                WHERE app_refresh_lease.leased_until <= NOW()
+                RETURNING app_id
             )
-            ON CONFLICT (app_id) DO UPDATE SET
-                developer_key = EXCLUDED.developer_key,
-                title = EXCLUDED.title,
-                summary = EXCLUDED.summary,
-                description = EXCLUDED.description,
-                installs = EXCLUDED.installs,
-                installs_min = EXCLUDED.installs_min,
-                installs_real = EXCLUDED.installs_real,
-                score = EXCLUDED.score,
-                ratings = EXCLUDED.ratings,
-                reviews_count = EXCLUDED.reviews_count,
-                histogram = EXCLUDED.histogram,
-                price = EXCLUDED.price,
-                free = EXCLUDED.free,
-                iap = EXCLUDED.iap,
-                genre = EXCLUDED.genre,
-                genre_id = EXCLUDED.genre_id,
-                content_rating = EXCLUDED.content_rating,
-                released = EXCLUDED.released,
-                updated = EXCLUDED.updated,
-                version = EXCLUDED.version,
-                url = EXCLUDED.url,
-                icon = EXCLUDED.icon,
-                header_image = EXCLUDED.header_image,
-                screenshots = EXCLUDED.screenshots,
-                video = EXCLUDED.video,
-                last_scraped = EXCLUDED.last_scraped
+            SELECT c.app_id
+            FROM claimed c
+            JOIN candidates USING (app_id)
+            ORDER BY candidates.last_scraped NULLS FIRST
         """
         with self.connect() as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     sql,
                     (
-                        meta.app_id,
-                        meta.developer_key,
-                        meta.title,
-                        meta.summary,
-                        meta.description,
-                        meta.installs,
-                        meta.installs_min,
-                        meta.installs_real,
-                        meta.score,
-                        meta.ratings,
-                        meta.reviews_count,
-                        json.dumps(meta.histogram) if meta.histogram is not None else None,
-                        meta.price,
-                        meta.free,
-                        meta.iap,
-                        meta.genre,
-                        meta.genre_id,
-                        meta.content_rating,
-                        meta.released,
-                        meta.updated,
-                        meta.version,
-                        meta.url,
-                        meta.icon,
-                        meta.header_image,
-                        json.dumps(meta.screenshots) if meta.screenshots is not None else None,
-                        meta.video,
-                        scraped_at,
+                        [lang for lang, _ in locales],
+                        [country for _, country in locales],
+                        tier_max_age_hours,
+                        tier_max_age_hours[-1],
+                        limit,
+                        owner,
+                        lease_seconds,
                     ),
                 )
+                app_ids = [row[0] for row in cur.fetchall()]
             conn.commit()
+        return app_ids
 
-    def insert_reviews(self, *, app_id: str, reviews: Iterable[dict[str, Any]]) -> int:
+    def claim_apps(self, *, owner: str, app_ids: list[str], lease_seconds: int) -> list[str]:
         sql = """
-            INSERT INTO app_reviews (
-                app_id, review_id, user_name, user_image,
-                content, score, thumbs_up,
-                version, date,
-                replied_at, reply_content
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (app_id, review_id) DO NOTHING
+            INSERT INTO app_refresh_lease (app_id, owner, leased_until, claimed_at)
+            SELECT app_id, %s, NOW() + make_interval(secs => %s), NOW()
+            FROM unnest(%s::text[]) AS t(app_id)
+            ON CONFLICT (app_id) DO UPDATE SET
+                owner = EXCLUDED.owner,
+                leased_until = EXCLUDED.leased_until,
+                claimed_at = EXCLUDED.claimed_at
+            WHERE app_refresh_lease.leased_until <= NOW()
+            RETURNING app_id
         """
-        inserted = 0
         with self.connect() as conn:
             with conn.cursor() as cur:
-                for r in reviews:
-                    cur.execute(
-                        sql,
-                        (
-                            app_id,
-                            r.get("review_id"),
-                            r.get("user_name"),
-                            r.get("user_image"),
-                            r.get("content"),
-                            r.get("score"),
-                            r.get("thumbs_up"),
-                            r.get("version"),
-                            r.get("date"),
-                            r.get("replied_at"),
-                            r.get("reply_content"),
-                        ),
-                    )
-                    inserted += cur.rowcount
+                cur.execute(sql, (owner, lease_seconds, app_ids))
+                claimed = {row[0] for row in cur.fetchall()}
             conn.commit()
-        return inserted
+        return [app_id for app_id in app_ids if app_id in claimed]
 
-    def replace_permissions(self, *, app_id: str, permissions: list[dict[str, Any]]) -> None:
-        delete_sql = "DELETE FROM app_permissions WHERE app_id = %s"
-        insert_sql = """
-            INSERT INTO app_permissions (app_id, category, permissions)
+    def renew_app_lease(self, *, app_id: str, owner: str, lease_seconds: int) -> bool:
+        sql = """
+            UPDATE app_refresh_lease
+            SET leased_until = NOW() + make_interval(secs => %s)
+            WHERE app_id = %s AND owner = %s
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (lease_seconds, app_id, owner))
+                renewed = cur.rowcount > 0
+            conn.commit()
+        return renewed
+
+    def release_app_lease(self, *, app_id: str, owner: str) -> None:
+        sql = "DELETE FROM app_refresh_lease WHERE app_id = %s AND owner = %s"
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (app_id, owner))
+            conn.commit()
+
+    def defer_app_lease(self, *, app_id: str, owner: str, delay_sec: int) -> None:
+        # Аренда остаётся до конца паузы: claim_stale_apps не вернёт упавшее приложение сразу
+        sql = """
+            UPDATE app_refresh_lease
+            SET leased_until = NOW() + make_interval(secs => %s)
+            WHERE app_id = %s AND owner = %s
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (delay_sec, app_id, owner))
+            conn.commit()
+
+    def list_unknown_apps(self, *, app_ids: list[str]) -> list[str]:
+        sql = "SELECT app_id FROM app_meta_info WHERE app_id = ANY(%s)"
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (app_ids,))
+                known = {row[0] for row in cur.fetchall()}
+        return [app_id for app_id in app_ids if app_id not in known]
+
+    def set_refresh_tier(self, *, app_ids: list[str], tier: int) -> None:
+        sql = "UPDATE app_meta_info SET refresh_tier = %s WHERE app_id = ANY(%s) AND refresh_tier <> %s"
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (tier, app_ids, tier))
+            conn.commit()
+
+    def get_reviews_high_water_mark(
+        self,
+        *,
+        app_id: str,
+        lang: str = DEFAULT_LANG,
+        country: str = DEFAULT_COUNTRY,
+    ) -> tuple[str | None, datetime | None]:
+        sql = """
+            SELECT review_id, date
+            FROM app_reviews
+            WHERE app_id = %s AND lang = %s AND country = %s AND date IS NOT NULL
+            ORDER BY date DESC
+            LIMIT 1
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (app_id, lang, country))
+                row = cur.fetchone()
+                if not row:
+                    return None, None
+        return row[0], parse_timestamptz(row[1])
+
+    def get_reviews_version(
+        self,
+        *,
+        app_id: str,
+        lang: str = DEFAULT_LANG,
+        country: str = DEFAULT_COUNTRY,
+    ) -> int | None:
+        sql = "SELECT reviews_version FROM app_meta_locale WHERE app_id = %s AND lang = %s AND country = %s"
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (app_id, lang, country))
+                row = cur.fetchone()
+        return row[0] if row else None
+
+    def get_review_digest(
+        self,
+        *,
+        app_id: str,
+        window: timedelta,
+        lang: str = DEFAULT_LANG,
+        country: str = DEFAULT_COUNTRY,
+    ) -> dict[str, Any]:
+        sql = """
+            SELECT COUNT(*), AVG(score)
+            FROM app_reviews
+            WHERE app_id = %s AND lang = %s AND country = %s AND date >= %s
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (app_id, lang, country, utcnow() - window))
+                row = cur.fetchone()
+        return {
+            "count": int(row[0] or 0),
+            "avg_score": round(float(row[1]), 3) if row[1] is not None else None,
+        }
+
+    def get_reviews(
+        self,
+        *,
+        app_id: str,
+        since: datetime,
+        until: datetime | None = None,
+        lang: str = DEFAULT_LANG,
+        country: str = DEFAULT_COUNTRY,
+        limit: int | None = None,
+    ) -> list[dict[str, Any]]:
+        # Границы по date дают планировщику отсечь лишние месячные секции
+        sql = """
+            SELECT review_id, user_name, content, score, thumbs_up, version, date, replied_at, reply_content
+            FROM app_reviews
+            WHERE app_id = %s AND lang = %s AND country = %s
+              AND date >= %s AND date < %s
+            ORDER BY date DESC
+            LIMIT %s
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (app_id, lang, country, since, until or utcnow() + timedelta(days=1), limit))
+                rows = cur.fetchall()
+        return [
+            {
+                "review_id": row[0],
+                "user_name": row[1],
+                "content": row[2],
+                "score": row[3],
+                "thumbs_up": row[4],
+                "version": row[5],
+                "date": parse_timestamptz(row[6]),
+                "replied_at": parse_timestamptz(row[7]),
+                "reply_content": row[8],
+            }
+            for row in rows
+        ]
+
+    def ensure_review_partitions(self, *, months: Iterable[date]) -> list[str]:
+        verified: set[tuple[str, str, str]] = set()
+        with self.connect() as conn:
+            created = ensure_review_partitions(conn, months, verified=verified)
+            conn.commit()
+        _KNOWN_REVIEW_PARTITIONS.update(verified)
+        return created
+
+    def drop_review_partitions_before(self, *, month: date) -> list[str]:
+        sql = """
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass('app_reviews')
+              AND c.relname ~ '^app_reviews_y[0-9]{4}m[0-9]{2}$'
+              AND c.relname < %s
+            ORDER BY c.relname
+        """
+        dropped: list[str] = []
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (review_partition_name(month),))
+                for (name,) in cur.fetchall():
+                    # Удаление секции вместо DELETE: без мёртвых строк и долгого VACUUM
+                    cur.execute(SQL("DROP TABLE {}").format(Identifier(name)))
+                    _KNOWN_REVIEW_PARTITIONS.discard(_review_partition_key(conn, "app_reviews", name))
+                    dropped.append(name)
+            conn.commit()
+        return dropped
+
+    def get_backfill_checkpoint(self, *, app_id: str, lang: str, country: str) -> BackfillCheckpoint | None:
+        sql = """
+            SELECT app_id, lang, country, continuation_token,
+                   pages, reviews_seen, reviews_inserted, status, updated_at
+            FROM app_review_backfill
+            WHERE app_id = %s AND lang = %s AND country = %s
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (app_id, lang, country))
+                row = cur.fetchone()
+                if not row:
+                    return None
+
+        return BackfillCheckpoint(
+            app_id=row[0],
+            lang=row[1],
+            country=row[2],
+            continuation_token=row[3],
+            pages=row[4],
+            reviews_seen=row[5],
+            reviews_inserted=row[6],
+            status=row[7],
+            updated_at=parse_timestamptz(row[8]),
+        )
+
+    def get_review_cursor(self, *, app_id: str, lang: str, country: str) -> ReviewCursor | None:
+        sql = """
+            SELECT hwm_review_id, hwm_date, gap_token, gap_until_review_id, gap_until_date
+            FROM app_review_cursor
+            WHERE app_id = %s AND lang = %s AND country = %s
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (app_id, lang, country))
+                row = cur.fetchone()
+                if not row:
+                    return None
+
+        return ReviewCursor(
+            app_id=app_id,
+            lang=lang,
+            country=country,
+            hwm_review_id=row[0],
+            hwm_date=parse_timestamptz(row[1]),
+            gap_token=row[2],
+            gap_until_review_id=row[3],
+            gap_until_date=parse_timestamptz(row[4]),
+        )
+
+    @contextmanager
+    def advisory_lock(self, key: str, *, timeout_sec: float) -> Iterator[bool]:
+        # lock_timeout = 0 в Postgres означает «ждать вечно»
+        if timeout_sec <= 0:
+            raise RuntimeError(f"advisory_lock timeout_sec must be positive, got {timeout_sec}")
+        lock_id = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+        deadline = time.monotonic() + timeout_sec
+        if not _ADVISORY_LOCK_SLOTS.acquire(timeout=timeout_sec):
+            yield False
+            return
+        try:
+            # Отдельное соединение вне пула: лидер держит блокировку весь скрейп и LLM и сам берёт
+            # соединения из пула, а ожидающие висят до timeout_sec — из пула это выедало бы JOB_WORKERS×3
+            with psycopg.connect(
+                self.database_url, autocommit=True, connect_timeout=max(1, int(DB_POOL_TIMEOUT))
+            ) as conn:
+                try:
+                    remaining_ms = max(1, int((deadline - time.monotonic()) * 1000))
+                    conn.execute(f"SET lock_timeout = '{remaining_ms}ms'")
+                    conn.execute("SELECT pg_advisory_lock(%s)", (lock_id,))
+                    acquired = True
+                except psycopg.errors.LockNotAvailable:
+                    acquired = False
+
+                try:
+                    yield acquired
+                finally:
+                    if acquired and not conn.broken:
+                        conn.execute("SELECT pg_advisory_unlock(%s)", (lock_id,))
+        finally:
+            _ADVISORY_LOCK_SLOTS.release()
+
+    def get_llm_response(self, *, cache_key: str, max_age: timedelta) -> tuple[str, datetime] | None:
+        sql = """
+            UPDATE llm_response_cache
+            SET hits = hits + 1, last_hit_at = NOW()
+            WHERE cache_key = %s AND created_at >= %s
+            RETURNING content, created_at
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (cache_key, utcnow() - max_age))
+                row = cur.fetchone()
+            conn.commit()
+        return (row[0], parse_timestamptz(row[1])) if row else None
+
+    def put_llm_response(self, *, cache_key: str, model: str, content: str) -> None:
+        sql = """
+            INSERT INTO llm_response_cache (cache_key, model, content, size_bytes)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (cache_key) DO UPDATE SET
+                model = EXCLUDED.model,
+                content = EXCLUDED.content,
+                size_bytes = EXCLUDED.size_bytes,
+                created_at = NOW(),
+                last_hit_at = NOW()
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (cache_key, model, content, len(content.encode("utf-8"))))
+            conn.commit()
+
+    def prune_llm_responses(self, *, max_bytes: int, max_age: timedelta) -> int:
+        sql = """
+            DELETE FROM llm_response_cache
+            WHERE created_at < %s
+               OR cache_key IN (
+                    SELECT cache_key
+                    FROM (
+                        SELECT cache_key,
+                               SUM(size_bytes) OVER (ORDER BY last_hit_at DESC, cache_key) AS running_bytes
+                        FROM llm_response_cache
+                    ) ranked
+                    WHERE running_bytes > %s
+               )
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (utcnow() - max_age, max_bytes))
+                deleted = cur.rowcount
+            conn.commit()
+        return deleted
+
+    def enqueue_job(self, *, kind: str, params: dict[str, Any], dedupe_key: str | None = None) -> str:
+        sql = """
+            INSERT INTO analysis_jobs (kind, params, dedupe_key)
             VALUES (%s, %s, %s)
+            ON CONFLICT (dedupe_key) WHERE status IN ('queued', 'running')
+            DO UPDATE SET dedupe_key = EXCLUDED.dedupe_key
+            RETURNING id
         """
         with self.connect() as conn:
             with conn.cursor() as cur:
-                cur.execute(delete_sql, (app_id,))
-                for p in permissions:
-                    cur.execute(
-                        insert_sql,
-                        (
-                            app_id,
-                            p.get("category"),
-                            json.dumps(p.get("permissions")) if isinstance(p.get("permissions"), (dict, list)) else p.get("permissions"),
-                        ),
-                    )
+                cur.execute(sql, (kind, json.dumps(params, default=_json_default), dedupe_key))
+                row = cur.fetchone()
+            conn.commit()
+        return str(row[0])
+
+    def claim_jobs(self, *, owner: str, limit: int, lease_seconds: int, max_attempts: int) -> list[Job]:
+        fail_sql = """
+            UPDATE analysis_jobs
+            SET status = 'failed', error = 'abandoned after ' || attempts || ' attempts', finished_at = NOW()
+            WHERE status = 'running' AND locked_until < NOW() AND attempts >= %s
+        """
+        claim_sql = """
+            UPDATE analysis_jobs
+            SET status = 'running',
+                attempts = attempts + 1,
+                locked_by = %s,
+                locked_until = NOW() + make_interval(secs => %s),
+                started_at = NOW()
+            WHERE id IN (
+                SELECT id
+                FROM analysis_jobs
+                WHERE status = 'queued'
+                   OR (status = 'running' AND locked_until < NOW() AND attempts < %s)
+                ORDER BY created_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, kind, params, status, result, error, attempts, created_at, started_at, finished_at, progress
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(fail_sql, (max_attempts,))
+                cur.execute(claim_sql, (owner, lease_seconds, max_attempts, limit))
+                rows = cur.fetchall()
             conn.commit()
+        return [_job_from_row(row) for row in rows]
+
+    def update_job_progress(self, *, job_id: str, progress: dict[str, Any]) -> None:
+        sql = "UPDATE analysis_jobs SET progress = %s WHERE id = %s AND status = 'running'"
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (json.dumps(progress, default=_json_default), job_id))
+            conn.commit()
+
+    # locked_by + attempts — признак владения: задание, перехваченное другим воркером
+    # (или этим же после истечения аренды), старый запуск уже не продлит и не перезапишет
+    def renew_job_lease(self, *, job_id: str, owner: str, attempts: int, lease_seconds: int) -> bool:
+        sql = """
+            UPDATE analysis_jobs
+            SET locked_until = NOW() + make_interval(secs => %s)
+            WHERE id = %s AND status = 'running' AND locked_by = %s AND attempts = %s
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (lease_seconds, job_id, owner, attempts))
+                renewed = cur.rowcount > 0
+            conn.commit()
+        return renewed
+
+    def complete_job(self, *, job_id: str, owner: str, attempts: int, result: Any) -> bool:
+        sql = """
+            UPDATE analysis_jobs
+            SET status = 'done', result = %s, error = NULL, locked_until = NULL, finished_at = NOW()
+            WHERE id = %s AND status = 'running' AND locked_by = %s AND attempts = %s
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (json.dumps(result, default=_json_default), job_id, owner, attempts))
+                completed = cur.rowcount > 0
+            conn.commit()
+        return completed
+
+    def fail_job(self, *, job_id: str, owner: str, attempts: int, error: str) -> bool:
+        sql = """
+            UPDATE analysis_jobs
+            SET status = 'failed', error = %s, locked_until = NULL, finished_at = NOW()
+            WHERE id = %s AND status = 'running' AND locked_by = %s AND attempts = %s
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (error, job_id, owner, attempts))
+                failed = cur.rowcount > 0
+            conn.commit()
+        return failed
+
+    def get_job(self, *, job_id: str) -> Job | None:
+        sql = """
+            SELECT id, kind, params, status, result, error, attempts, created_at, started_at, finished_at, progress
+            FROM analysis_jobs
+            WHERE id = %s
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (job_id,))
+                row = cur.fetchone()
+                if not row:
+                    return None
+        return _job_from_row(row)
+
+    def purge_jobs(self, *, older_than: timedelta) -> int:
+        sql = "DELETE FROM analysis_jobs WHERE status IN ('done', 'failed') AND finished_at < %s"
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (utcnow() - older_than,))
+                deleted = cur.rowcount
+            conn.commit()
+        return deleted
+
+    def unit_of_work(self) -> AbstractContextManager["UnitOfWork"]:
+        return _unit_of_work(self)
+
+    def upsert_developer(
+        self,
+        *,
+        developer_key: str,
+        name: str | None,
+        email: str | None,
+        website: str | None,
+        address: str | None,
+        scraped_at: datetime | None = None,
+    ) -> None:
+        with self.unit_of_work() as uow:
+            uow.upsert_developer(
+                developer_key=developer_key,
+                name=name,
+                email=email,
+                website=website,
+                address=address,
+                scraped_at=scraped_at,
+            )
+
+    def upsert_meta_info(self, meta: MetaInfo, *, scraped_at: datetime | None = None) -> MetaInfo:
+        with self.unit_of_work() as uow:
+            return uow.upsert_meta_info(meta, scraped_at=scraped_at)
+
+    def insert_reviews(
+        self,
+        *,
+        app_id: str,
+        reviews: Iterable[dict[str, Any]],
+        lang: str = DEFAULT_LANG,
+        country: str = DEFAULT_COUNTRY,
+    ) -> int:
+        with self.unit_of_work() as uow:
+            return uow.insert_reviews(app_id=app_id, reviews=reviews, lang=lang, country=country)
+
+    def replace_permissions(self, *, app_id: str, permissions: list[dict[str, Any]]) -> None:
+        with self.unit_of_work() as uow:
+            uow.replace_permissions(app_id=app_id, permissions=permissions)
+
+
+def _job_from_row(row: tuple[Any, ...]) -> Job:
+    return Job(
+        id=str(row[0]),
+        kind=row[1],
+        params=row[2],
+        status=row[3],
+        result=row[4],
+        error=row[5],
+        attempts=row[6],
+        created_at=parse_timestamptz(row[7]),
+        started_at=parse_timestamptz(row[8]),
+        finished_at=parse_timestamptz(row[9]),
+        progress=row[10],
+    )
+
+
+@contextmanager
+def _unit_of_work(db: Database) -> Iterator[UnitOfWork]:
+    with db.connect() as conn:
+        uow = UnitOfWork(conn)
+        yield uow
+        uow.flush()
+    _KNOWN_REVIEW_PARTITIONS.update(uow.partitions)
+    # После коммита, чтобы параллельное чтение не закэшировало старую строку заново
+    for kind, app_id, lang, country in uow.touched:
+        _invalidate_locale(kind, db.database_url, app_id, lang, country)
 
 
 def is_fresh(ts: datetime | None, *, max_age: timedelta) -> bool:
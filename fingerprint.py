@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import hashlib
+from typing import Any
+
+from config import get_env_float
+from db import MetaInfo
+
+
+FINGERPRINT_VERSION = 2
+
+FP_SCORE_DELTA = get_env_float("ANALYSIS_FP_SCORE_DELTA", 0.1)
+FP_RATINGS_PCT = get_env_float("ANALYSIS_FP_RATINGS_PCT", 5.0)
+FP_REVIEWS_COUNT_PCT = get_env_float("ANALYSIS_FP_REVIEWS_COUNT_PCT", 5.0)
+FP_RECENT_REVIEWS_PCT = get_env_float("ANALYSIS_FP_RECENT_REVIEWS_PCT", 25.0)
+FP_RECENT_REVIEW_SCORE_DELTA = get_env_float("ANALYSIS_FP_RECENT_REVIEW_SCORE_DELTA", 0.3)
+
+_TEXT_FIELDS = ("title", "summary", "description", "genre", "genre_id", "content_rating", "version")
+_EXACT_FIELDS = ("installs_min", "price", "free", "iap")
+# Входы анализа помимо данных приложения: другой контекст, модель или шаблон — другой ответ LLM
+_INPUT_FIELDS = ("user_context", "model", "prompt")
+
+
+def _digest(value: Any) -> str | None:
+    if value is None:
+        return None
+    return hashlib.sha1(str(value).encode("utf-8")).hexdigest()[:16]
+
+
+def _abs_delta(old: Any, new: Any) -> float | None:
+    if old is None or new is None:
+        return None if old == new else float("inf")
+    return abs(float(new) - float(old))
+
+
+def _pct_delta(old: Any, new: Any) -> float | None:
+    if old is None or new is None:
+        return None if old == new else float("inf")
+    if float(old) == 0:
+        return 0.0 if float(new) == 0 else float("inf")
+    return abs(float(new) - float(old)) / abs(float(old)) * 100
+
+
+def build_fingerprint(
+    meta: MetaInfo,
+    review_digest: dict[str, Any],
+    *,
+    user_context: str | None,
+    model: str,
+    prompt_template: str,
+) -> dict[str, Any]:
+    fp: dict[str, Any] = {"v": FINGERPRINT_VERSION}
+    fp["user_context"] = _digest(user_context)
+    fp["model"] = model
+    fp["prompt"] = prompt_template
+    for field in _TEXT_FIELDS:
+        fp[field] = _digest(getattr(meta, field))
+    for field in _EXACT_FIELDS:
+        fp[field] = getattr(meta, field)
+    fp["score"] = meta.score
+    fp["ratings"] = meta.ratings
+    fp["reviews_count"] = meta.reviews_count
+    fp["recent_reviews"] = review_digest.get("count")
+    fp["recent_review_score"] = review_digest.get("avg_score")
+    return fp
+
+
+def changed_fields(old: dict[str, Any] | None, new: dict[str, Any]) -> list[str]:
+    if not old or old.get("v") != new.get("v"):
+        return ["*"]
+
+    changed = [f for f in _INPUT_FIELDS + _TEXT_FIELDS + _EXACT_FIELDS if old.get(f) != new.get(f)]
+
+    thresholds = (
+        ("score", _abs_delta, FP_SCORE_DELTA),
+        ("ratings", _pct_delta, FP_RATINGS_PCT),
+        ("reviews_count", _pct_delta, FP_REVIEWS_COUNT_PCT),
+        ("recent_reviews", _pct_delta, FP_RECENT_REVIEWS_PCT),
+        ("recent_review_score", _abs_delta, FP_RECENT_REVIEW_SCORE_DELTA),
+    )
+    for field, delta_fn, limit in thresholds:
+        delta = delta_fn(old.get(field), new.get(field))
+        if delta is not None and delta > limit:
+            changed.append(field)
+    return changed
+
+
+def meta_changed(old: dict[str, Any] | None, meta: MetaInfo) -> bool:
+    if not old:
+        return True
+    probe = build_fingerprint(
+        meta,
+        {"count": old.get("recent_reviews"), "avg_score": old.get("recent_review_score")},
+        user_context=None,
+        model="",
+        prompt_template="",
+    )
+    # Входы анализа здесь не сверяем — это сделает полный отпечаток
+    return bool(set(changed_fields(old, probe)) - set(_INPUT_FIELDS))
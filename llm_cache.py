@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from datetime import timedelta
+
+from cache import TTLCache
+from config import get_env_bool, get_env_int
+from db import Database, utcnow
+
+
+LLM_CACHE_ENABLED = get_env_bool("LLM_CACHE_ENABLED", True)
+LLM_CACHE_TTL_SEC = get_env_int("LLM_CACHE_TTL_SEC", 7 * 24 * 3600)
+LLM_CACHE_MEMORY_ENTRIES = get_env_int("LLM_CACHE_MEMORY_ENTRIES", 256)
+LLM_CACHE_MAX_MB = get_env_int("LLM_CACHE_MAX_MB", 256)
+LLM_CACHE_PRUNE_EVERY = get_env_int("LLM_CACHE_PRUNE_EVERY", 100)
+
+_cache: ResponseCache | None = None
+_cache_lock = threading.Lock()
+
+
+def cache_key(*, model: str, temperature: float, prompt: str) -> str:
+    normalized = " ".join(prompt.split())
+    payload = json.dumps(
+        {"model": model, "temperature": temperature, "prompt": normalized},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, db: Database, *, ttl_sec: int = LLM_CACHE_TTL_SEC) -> None:
+        self.db = db
+        self.ttl = timedelta(seconds=ttl_sec)
+        self.memory = TTLCache(max_entries=LLM_CACHE_MEMORY_ENTRIES, ttl_sec=ttl_sec) if LLM_CACHE_MEMORY_ENTRIES > 0 else None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.puts = 0
+
+    def get(self, key: str) -> str | None:
+        if self.memory is not None:
+            content = self.memory.get(key)
+            if content is not None:
+                with self._lock:
+                    self.memory_hits += 1
+                return content
+
+        try:
+            row = self.db.get_llm_response(cache_key=key, max_age=self.ttl)
+        except Exception:  # noqa: BLE001
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.db_hits += 1
+        if row is None:
+            return None
+        content, created_at = row
+        if self.memory is not None:
+            # В памяти запись живёт не дольше, чем осталось строке в БД
+            self.memory.set(key, content, ttl_sec=(created_at + self.ttl - utcnow()).total_seconds())
+        return content
+
+    def put(self, key: str, *, model: str, content: str) -> None:
+        if self.memory is not None:
+            self.memory.set(key, content)
+        try:
+            self.db.put_llm_response(cache_key=key, model=model, content=content)
+        except Exception:  # noqa: BLE001
+            return
+
+        with self._lock:
+            self.puts += 1
+            prune = LLM_CACHE_PRUNE_EVERY > 0 and self.puts % LLM_CACHE_PRUNE_EVERY == 0
+        if prune:
+            try:
+                self.db.prune_llm_responses(max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024, max_age=self.ttl)
+            except Exception:  # noqa: BLE001
+                pass
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            stats = {
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "puts": self.puts,
+            }
+        if self.memory is not None:
+            stats["memory_size"] = self.memory.stats()["size"]
+            stats["memory_evictions"] = self.memory.stats()["evictions"]
+        return stats
+
+
+def get_response_cache() -> ResponseCache | None:
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(Database())
+        return _cache
@@ -1,13 +1,39 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import os
 import re
-from datetime import date, datetime
+import threading
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Callable
 
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+from config import get_env_float, get_env_int
+from llm_cache import cache_key, get_response_cache
+from prompt_builder import build_analysis_prompt, build_batch_prompt
+from ratelimit import TokenBucket
+
+
+PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
+LLM_TEMPERATURE = 0.2
+LLM_TIMEOUT_SEC = get_env_float("LLM_TIMEOUT_SEC", 90.0)
+LLM_CONNECT_TIMEOUT_SEC = get_env_float("LLM_CONNECT_TIMEOUT_SEC", 10.0)
+LLM_MAX_CONNECTIONS = get_env_int("LLM_MAX_CONNECTIONS", 20)
+LLM_MAX_KEEPALIVE = get_env_int("LLM_MAX_KEEPALIVE", 10)
+LLM_KEEPALIVE_EXPIRY_SEC = get_env_float("LLM_KEEPALIVE_EXPIRY_SEC", 120.0)
+LLM_MAX_RETRIES = get_env_int("LLM_MAX_RETRIES", 3)
+LLM_CONCURRENCY = get_env_int("LLM_CONCURRENCY", 8)
+
+LLM_LIMITER = TokenBucket(
+    rate=get_env_float("LLM_RATE_PER_SEC", 2.0),
+    burst=get_env_int("LLM_RATE_BURST", 4),
+)
+
+_client: OpenAI | None = None
+_client_lock = threading.Lock()
 
 
 @dataclass
@@ -16,6 +42,7 @@ class AnalysisResult:
     recommendations: list[str]
     raw: Any
     prompt_used: str
+    prompt_tokens_est: int | None = None
 
 
 def _extract_json_object(text: str) -> dict[str, Any] | None:
@@ -41,36 +68,43 @@ def _as_int(v: Any) -> int | None:
         return None
 
 
-def _json_default(obj: Any):
-    if isinstance(obj, (datetime, date)):
-        return obj.isoformat()
-    return str(obj)
-
-
-def analyze_app(*, app_id: str, meta: dict[str, Any], scenario: str, user_context: str | None) -> AnalysisResult:
+def _api_key() -> str:
     api_key = os.getenv("PERPLEXITY_API_KEY")
     if not api_key:
         raise RuntimeError("PERPLEXITY_API_KEY is not set")
+    return api_key
 
-    client = OpenAI(api_key=api_key, base_url="https://api.perplexity.ai")
 
-    prompt = (
-        "You are a product analyst. Return JSON only (no markdown, no code fences). "
-        "Schema: {\"market_fit\": int 0..10, \"recommendations\": [string], \"notes\": string}. "
-        f"Scenario: {scenario}. "
-        f"User context: {user_context or ''}. "
-        f"App id: {app_id}. "
-        "App data: "
-        + json.dumps(meta, ensure_ascii=False, default=_json_default)
-    )
+def _model() -> str:
+    return os.getenv("PERPLEXITY_MODEL") or "sonar-pro"
 
-    response = client.chat.completions.create(
-        model=os.getenv("PERPLEXITY_MODEL") or "sonar-pro",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.2,
-    )
 
-    content = (response.choices[0].message.content or "").strip()
+def _http_options() -> dict[str, Any]:
+    return {
+        "timeout": httpx.Timeout(LLM_TIMEOUT_SEC, connect=LLM_CONNECT_TIMEOUT_SEC),
+        "limits": httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY_SEC,
+        ),
+    }
+
+
+def get_client() -> OpenAI:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAI(
+                api_key=_api_key(),
+                base_url=PERPLEXITY_BASE_URL,
+                max_retries=LLM_MAX_RETRIES,
+                http_client=httpx.Client(**_http_options()),
+            )
+        return _client
+
+
+def _parse_result(content: str, *, prompt: str, prompt_tokens_est: int | None = None) -> AnalysisResult:
+    content = content.strip()
     parsed = _extract_json_object(content)
     raw = {"content": content}
     if parsed is not None:
@@ -82,4 +116,226 @@ def analyze_app(*, app_id: str, meta: dict[str, Any], scenario: str, user_contex
         recs = []
     recs_str = [str(x) for x in recs if x is not None]
 
-    return AnalysisResult(market_fit=market_fit, recommendations=recs_str, raw=raw, prompt_used=prompt)
+    return AnalysisResult(
+        market_fit=market_fit,
+        recommendations=recs_str,
+        raw=raw,
+        prompt_used=prompt,
+        prompt_tokens_est=prompt_tokens_est,
+    )
+
+
+def _json_string_end(text: str, start: int) -> int | None:
+    i = start + 1
+    while i < len(text):
+        ch = text[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if ch == '"':
+            return i
+        i += 1
+    return None
+
+
+class RecommendationStreamParser:
+    def __init__(self) -> None:
+        self.text = ""
+        self._pos: int | None = None
+        self._done = False
+
+    def feed(self, chunk: str) -> list[str]:
+        self.text += chunk
+        if self._done:
+            return []
+
+        if self._pos is None:
+            match = re.search(r'"recommendations"\s*:\s*\[', self.text)
+            if not match:
+                return []
+            self._pos = match.end()
+
+        out: list[str] = []
+        while True:
+            i = self._pos
+            while i < len(self.text) and self.text[i] in " \t\r\n,":
+                i += 1
+            self._pos = i
+            if i >= len(self.text):
+                return out
+            if self.text[i] != '"':
+                self._done = True
+                return out
+            end = _json_string_end(self.text, i)
+            if end is None:
+                return out
+            try:
+                out.append(str(json.loads(self.text[i : end + 1])))
+            except json.JSONDecodeError:
+                self._done = True
+                return out
+            self._pos = end + 1
+
+
+def _cacheable(content: str) -> bool:
+    return _extract_json_object(content) is not None
+
+
+def _complete(prompt: str, *, on_recommendation: Callable[[str], None] | None = None) -> str:
+    model = _model()
+    cache = get_response_cache()
+    key = cache_key(model=model, temperature=LLM_TEMPERATURE, prompt=prompt)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            if on_recommendation is not None:
+                for rec in RecommendationStreamParser().feed(cached):
+                    on_recommendation(rec)
+            return cached
+
+    LLM_LIMITER.acquire()
+    if on_recommendation is None:
+        response = get_client().chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=LLM_TEMPERATURE,
+        )
+        content = response.choices[0].message.content or ""
+    else:
+        stream = get_client().chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=LLM_TEMPERATURE,
+            stream=True,
+        )
+        parser = RecommendationStreamParser()
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            for rec in parser.feed(chunk.choices[0].delta.content or ""):
+                on_recommendation(rec)
+        content = parser.text
+
+    if cache is not None and _cacheable(content):
+        cache.put(key, model=model, content=content)
+    return content
+
+
+async def _acomplete(client: AsyncOpenAI, prompt: str) -> str:
+    model = _model()
+    cache = get_response_cache()
+    key = cache_key(model=model, temperature=LLM_TEMPERATURE, prompt=prompt)
+    if cache is not None:
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            return cached
+
+    await LLM_LIMITER.acquire_async()
+    response = await client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=LLM_TEMPERATURE,
+    )
+    content = response.choices[0].message.content or ""
+
+    if cache is not None and _cacheable(content):
+        await asyncio.to_thread(cache.put, key, model=model, content=content)
+    return content
+
+
+def analyze_app(
+    *,
+    app_id: str,
+    meta: dict[str, Any],
+    scenario: str,
+    user_context: str | None,
+    on_recommendation: Callable[[str], None] | None = None,
+) -> AnalysisResult:
+    prompt = build_analysis_prompt(app_id=app_id, meta=meta, scenario=scenario, user_context=user_context)
+    content = _complete(prompt.text, on_recommendation=on_recommendation)
+    return _parse_result(content, prompt=prompt.text, prompt_tokens_est=prompt.token_estimate)
+
+
+def _parse_batch_result(
+    content: str,
+    *,
+    app_ids: list[str],
+    prompt: str,
+    prompt_tokens_est: int,
+) -> dict[str, AnalysisResult]:
+    parsed = _extract_json_object(content.strip())
+    entries = (parsed or {}).get("apps")
+    if not isinstance(entries, list):
+        return {}
+
+    wanted = set(app_ids)
+    per_app_tokens = -(-prompt_tokens_est // max(1, len(app_ids)))
+    out: dict[str, AnalysisResult] = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        app_id = entry.get("app_id")
+        if app_id not in wanted or app_id in out:
+            continue
+        market_fit = _as_int(entry.get("market_fit"))
+        recs = entry.get("recommendations")
+        if market_fit is None or not isinstance(recs, list):
+            continue
+        out[app_id] = AnalysisResult(
+            market_fit=market_fit,
+            recommendations=[str(x) for x in recs if x is not None],
+            raw=entry,
+            prompt_used=prompt,
+            prompt_tokens_est=per_app_tokens,
+        )
+    return out
+
+
+def analyze_batch(
+    *,
+    items: list[dict[str, Any]],
+    scenario: str,
+    user_context: str | None,
+) -> dict[str, AnalysisResult]:
+    prompt = build_batch_prompt(
+        apps=[(item["app_id"], item["meta"]) for item in items],
+        scenario=scenario,
+        user_context=user_context,
+    )
+    content = _complete(prompt.text)
+    return _parse_batch_result(
+        content,
+        app_ids=[item["app_id"] for item in items],
+        prompt=prompt.text,
+        prompt_tokens_est=prompt.token_estimate,
+    )
+
+
+async def analyze_apps(
+    items: list[dict[str, Any]],
+    *,
+    concurrency: int | None = None,
+) -> list[AnalysisResult | Exception]:
+    client = AsyncOpenAI(
+        api_key=_api_key(),
+        base_url=PERPLEXITY_BASE_URL,
+        max_retries=LLM_MAX_RETRIES,
+        http_client=httpx.AsyncClient(**_http_options()),
+    )
+    semaphore = asyncio.Semaphore(max(1, concurrency or LLM_CONCURRENCY))
+
+    async def _one(item: dict[str, Any]) -> AnalysisResult:
+        prompt = build_analysis_prompt(
+            app_id=item["app_id"],
+            meta=item["meta"],
+            scenario=item["scenario"],
+            user_context=item.get("user_context"),
+        )
+        async with semaphore:
+            content = await _acomplete(client, prompt.text)
+        return _parse_result(content, prompt=prompt.text, prompt_tokens_est=prompt.token_estimate)
+
+    try:
+        return await asyncio.gather(*(_one(item) for item in items), return_exceptions=True)
+    finally:
+        await client.close()
@@ -0,0 +1,219 @@
+import sys
+import time
+from datetime import date
+
+import psycopg
+
+from config import get_env_float, get_env_int
+from db import Database, ensure_review_partitions, month_start, next_month, utcnow
+
+
+REVIEWS_MIGRATE_BATCH = get_env_int("REVIEWS_MIGRATE_BATCH", 20000)
+REVIEWS_MIGRATE_SLEEP = get_env_float("REVIEWS_MIGRATE_SLEEP", 0.2)
+REVIEWS_SWAP_LOCK_TIMEOUT = get_env_int("REVIEWS_SWAP_LOCK_TIMEOUT_MS", 5000)
+REVIEWS_PARTITION_AHEAD_MONTHS = get_env_int("REVIEWS_PARTITION_AHEAD_MONTHS", 2)
+REVIEWS_RETENTION_MONTHS = get_env_int("REVIEWS_RETENTION_MONTHS", 0)
+
+_COLUMNS = """
+    id, app_id, lang, country, review_id, user_name, user_image,
+    content, score, thumbs_up, version, date,
+    replied_at, reply_content, scraped_at
+"""
+
+# (имя, определение) — на новой таблице создаются с суффиксом _part и переименовываются при подмене
+_INDEXES = (
+    ("idx_reviews_app_date", "CREATE INDEX IF NOT EXISTS {name} ON app_reviews_part(app_id, date DESC)"),
+    (
+        "idx_reviews_app_locale_date",
+        "CREATE INDEX IF NOT EXISTS {name} ON app_reviews_part(app_id, lang, country, date DESC)",
+    ),
+    (
+        "idx_reviews_app_locale_review_date",
+        "CREATE UNIQUE INDEX IF NOT EXISTS {name} ON app_reviews_part(app_id, lang, country, review_id, date)",
+    ),
+    ("idx_reviews_date_brin", "CREATE INDEX IF NOT EXISTS {name} ON app_reviews_part USING BRIN (date)"),
+)
+
+_COPY_BATCH_SQL = f"""
+    INSERT INTO app_reviews_part ({_COLUMNS})
+    SELECT {_COLUMNS}
+    FROM app_reviews
+    WHERE id > %s AND id <= %s AND date IS NOT NULL
+    ON CONFLICT DO NOTHING
+"""
+
+
+# Удаления из старой таблицы во время переноса (правка отзыва = удаление + вставка, чистка по сроку):
+# без журнала скопированная ранее строка пережила бы подмену и отзыв задвоился бы
+_CAPTURE_DELETES_SQL = (
+    "CREATE TABLE IF NOT EXISTS app_reviews_migrate_deleted (id BIGINT NOT NULL)",
+    """
+    CREATE OR REPLACE FUNCTION app_reviews_migrate_log_delete() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO app_reviews_migrate_deleted (id) SELECT id FROM old_rows;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS app_reviews_migrate_deleted ON app_reviews",
+    """
+    CREATE TRIGGER app_reviews_migrate_deleted
+    AFTER DELETE ON app_reviews
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION app_reviews_migrate_log_delete()
+    """,
+)
+
+
+def _months_between(first: date, last: date) -> list[date]:
+    months = [first]
+    while months[-1] < last:
+        months.append(next_month(months[-1]))
+    return months
+
+
+def _relkind(conn: psycopg.Connection, name: str) -> str | None:
+    row = conn.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def _create_partitioned_copy(db: Database) -> None:
+    with db.connect() as conn:
+        if _relkind(conn, "app_reviews_part") is None:
+            conn.execute(
+                "CREATE TABLE app_reviews_part (LIKE app_reviews INCLUDING DEFAULTS) PARTITION BY RANGE (date)"
+            )
+            conn.execute("ALTER TABLE app_reviews_part ALTER COLUMN date SET NOT NULL")
+            conn.execute("ALTER TABLE app_reviews_part ADD PRIMARY KEY (id, date)")
+            conn.execute(
+                "ALTER TABLE app_reviews_part ADD FOREIGN KEY (app_id) "
+                "REFERENCES app_meta_info(app_id) ON DELETE CASCADE"
+            )
+            conn.execute("CREATE TABLE app_reviews_part_default PARTITION OF app_reviews_part DEFAULT")
+        for name, ddl in _INDEXES:
+            conn.execute(ddl.format(name=f"{name}_part"))
+
+        row = conn.execute("SELECT MIN(date), MAX(date) FROM app_reviews").fetchone()
+        if row[0] is not None:
+            months = _months_between(month_start(row[0]), month_start(row[1]))
+            ensure_review_partitions(conn, months, parent="app_reviews_part")
+        conn.commit()
+
+
+def _swap(db: Database, *, copied_up_to: int) -> tuple[int, int]:
+    with db.connect() as conn:
+        conn.execute("SELECT set_config('lock_timeout', %s, true)", (f"{REVIEWS_SWAP_LOCK_TIMEOUT}ms",))
+        # Запись блокируется только на время догоняющей копии и переименования; чтение идёт дальше
+        conn.execute("LOCK TABLE app_reviews IN SHARE ROW EXCLUSIVE MODE")
+
+        # Перекрываем последний пакет: строки с id из него могли закоммититься уже после копирования
+        copy_from = max(0, copied_up_to - REVIEWS_MIGRATE_BATCH)
+        row = conn.execute(
+            "SELECT MIN(date), MAX(date), COALESCE(MAX(id), 0) FROM app_reviews WHERE id > %s",
+            (copy_from,),
+        ).fetchone()
+        if row[0] is not None:
+            ensure_review_partitions(
+                conn,
+                _months_between(month_start(row[0]), month_start(row[1])),
+                parent="app_reviews_part",
+            )
+        cur = conn.execute(_COPY_BATCH_SQL, (copy_from, max(row[2], copied_up_to)))
+        tail = max(cur.rowcount, 0)
+        # Под блокировкой новых удалений нет: применяем журнал целиком
+        cur = conn.execute(
+            "DELETE FROM app_reviews_part p USING app_reviews_migrate_deleted d WHERE p.id = d.id"
+        )
+        reconciled = max(cur.rowcount, 0)
+        conn.execute("DROP TRIGGER app_reviews_migrate_deleted ON app_reviews")
+        conn.execute("DROP TABLE app_reviews_migrate_deleted")
+        conn.execute("DROP FUNCTION app_reviews_migrate_log_delete()")
+
+        conn.execute("ALTER TABLE app_reviews RENAME TO app_reviews_legacy")
+        conn.execute("ALTER TABLE app_reviews_part RENAME TO app_reviews")
+        conn.execute("ALTER TABLE app_reviews_part_default RENAME TO app_reviews_default")
+        for name, _ in _INDEXES:
+            conn.execute(f"ALTER INDEX IF EXISTS {name} RENAME TO {name}_legacy")
+            conn.execute(f"ALTER INDEX {name}_part RENAME TO {name}")
+        # Иначе последовательность удалится вместе с app_reviews_legacy
+        conn.execute("ALTER SEQUENCE app_reviews_id_seq OWNED BY app_reviews.id")
+        conn.commit()
+    return tail, reconciled
+
+
+def migrate(db: Database) -> dict:
+    with db.connect() as conn:
+        if _relkind(conn, "app_reviews") == "p":
+            return {"status": "already_partitioned"}
+        max_id, skipped = conn.execute(
+            "SELECT COALESCE(MAX(id), 0), COUNT(*) FILTER (WHERE date IS NULL) FROM app_reviews"
+        ).fetchone()
+
+    # Новый ON CONFLICT (app_id, lang, country, review_id, date) должен работать и на старой таблице до подмены
+    with psycopg.connect(db.database_url, autocommit=True) as conn:
+        conn.execute(
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_reviews_app_locale_review_date "
+            "ON app_reviews(app_id, lang, country, review_id, date)"
+        )
+
+    # Журнал удалений включается до первой копии: всё, что удалят после, вычистим при подмене
+    with db.connect() as conn:
+        for stmt in _CAPTURE_DELETES_SQL:
+            conn.execute(stmt)
+        conn.commit()
+
+    _create_partitioned_copy(db)
+
+    copied = 0
+    last_id = 0
+    started = time.perf_counter()
+    while last_id < max_id:
+        upper = min(last_id + REVIEWS_MIGRATE_BATCH, max_id)
+        with db.connect() as conn:
+            cur = conn.execute(_COPY_BATCH_SQL, (last_id, upper))
+            copied += max(cur.rowcount, 0)
+            conn.commit()
+        last_id = upper
+        print({"copied": copied, "last_id": last_id, "max_id": max_id})
+        time.sleep(REVIEWS_MIGRATE_SLEEP)
+
+    tail, reconciled = _swap(db, copied_up_to=last_id)
+    return {
+        "status": "migrated",
+        "rows_copied": copied + tail,
+        "rows_in_swap": tail,
+        "rows_deleted_in_swap": reconciled,
+        "skipped_without_date": skipped,
+        "elapsed_sec": round(time.perf_counter() - started, 3),
+        "next_step": "verify, then DROP TABLE app_reviews_legacy",
+    }
+
+
+def maintain(db: Database) -> dict:
+    current = month_start(utcnow())
+    months = [current]
+    for _ in range(max(0, REVIEWS_PARTITION_AHEAD_MONTHS)):
+        months.append(next_month(months[-1]))
+    created = db.ensure_review_partitions(months=months)
+
+    dropped: list[str] = []
+    if REVIEWS_RETENTION_MONTHS > 0:
+        cutoff = current
+        for _ in range(REVIEWS_RETENTION_MONTHS):
+            cutoff = date(cutoff.year - (cutoff.month == 1), (cutoff.month - 2) % 12 + 1, 1)
+        dropped = db.drop_review_partitions_before(month=cutoff)
+    return {"status": "maintained", "created": created, "dropped": dropped}
+
+
+def main() -> None:
+    command = sys.argv[1] if len(sys.argv) > 1 else "maintain"
+    db = Database()
+    if command == "migrate":
+        print(migrate(db))
+    elif command == "maintain":
+        print(maintain(db))
+    else:
+        raise RuntimeError("Usage: python partition_reviews.py [migrate|maintain]")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,53 @@
 from __future__ import annotations
 
-from dataclasses import asdict
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, replace
 from datetime import timedelta
-from typing import Any
+from typing import Any, Callable, Iterator
 
-from config import get_env_int
-from db import Database, MetaInfo, is_fresh
-from llm_perplexity import analyze_app
-from scraper_google_play import scrape_app_meta, scrape_reviews
+from config import get_env_bool, get_env_float, get_env_int
+from db import AnalysisRow, Database, MetaInfo, ReviewCursor, is_fresh, new_lease_owner
+from fingerprint import build_fingerprint, changed_fields, meta_changed
+from llm_perplexity import _model, analyze_app, analyze_apps, analyze_batch
+from prompt_builder import prompt_template_hash
+from scraper_google_play import (
+    continuation_token_from_dict,
+    continuation_token_to_dict,
+    scrape_app_meta,
+    scrape_reviews,
+    scrape_reviews_since,
+)
 
 
 ANALYSIS_MAX_AGE_DAYS = get_env_int("ANALYSIS_MAX_AGE_DAYS", 7)
+ANALYSIS_MAX_STALE_DAYS = get_env_int("ANALYSIS_MAX_STALE_DAYS", 30)
 META_MAX_AGE_DAYS = get_env_int("META_MAX_AGE_DAYS", 7)
 REVIEWS_MAX_AGE_DAYS = get_env_int("REVIEWS_MAX_AGE_DAYS", 7)
+ANALYSIS_FP_REVIEW_WINDOW_DAYS = get_env_int("ANALYSIS_FP_REVIEW_WINDOW_DAYS", 30)
 REVIEWS_COUNT = get_env_int("REVIEWS_COUNT", 100)
+REVIEWS_INCREMENTAL = get_env_bool("REVIEWS_INCREMENTAL", True)
+REVIEWS_INCREMENTAL_MAX = get_env_int("REVIEWS_INCREMENTAL_MAX", 2000)
+REFRESH_LEASE_SEC = get_env_int("REFRESH_LEASE_SEC", 900)
+REFRESH_HEARTBEAT_SEC = get_env_float("REFRESH_HEARTBEAT_SEC", max(1.0, REFRESH_LEASE_SEC / 3))
+ANALYSIS_LOCK_TIMEOUT_SEC = get_env_float("ANALYSIS_LOCK_TIMEOUT_SEC", 120.0)
+PIPELINE_OVERLAP = get_env_bool("PIPELINE_OVERLAP", True)
+PIPELINE_REVIEW_WORKERS = get_env_int("PIPELINE_REVIEW_WORKERS", 4)
+LOCALE_FANOUT_WORKERS = get_env_int("LOCALE_FANOUT_WORKERS", 4)
+BATCH_SCRAPE_WORKERS = get_env_int("BATCH_SCRAPE_WORKERS", 4)
+LLM_BATCH_SIZE = get_env_int("LLM_BATCH_SIZE", 10)
 
+_INFLIGHT: dict[tuple[str, str, str, str, str, bool], Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
 
-def _meta_to_db(meta) -> MetaInfo:
+# Пул для ветки «скрейп отзывов → запись», которая идёт параллельно с LLM
+_REVIEW_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, PIPELINE_REVIEW_WORKERS), thread_name_prefix="reviews")
+
+
+def _meta_to_db(meta, *, lang: str, country: str) -> MetaInfo:
     return MetaInfo(
         app_id=meta.app_id,
         developer_key=meta.developer_key,
@@ -45,10 +76,200 @@ def _meta_to_db(meta) -> MetaInfo:
         screenshots=meta.screenshots,
         video=meta.video,
         last_scraped=None,
+        lang=lang,
+        country=country,
     )
 
 
-def run_user_pipeline(
+def _scrape_new_reviews(
+    db: Database, *, app_id: str, lang: str, country: str
+) -> tuple[list[dict[str, Any]], ReviewCursor | None]:
+    if not REVIEWS_INCREMENTAL:
+        return scrape_reviews(app_id, lang=lang, country=country, count=REVIEWS_COUNT), None
+
+    cursor = db.get_review_cursor(app_id=app_id, lang=lang, country=country)
+    if cursor is None:
+        hwm_review_id, hwm_date = db.get_reviews_high_water_mark(app_id=app_id, lang=lang, country=country)
+        cursor = ReviewCursor(app_id, lang, country, hwm_review_id, hwm_date, None, None, None)
+    budget = REVIEWS_COUNT if cursor.hwm_date is None else REVIEWS_INCREMENTAL_MAX
+    out: list[dict[str, Any]] = []
+
+    # Сначала дочитываем хвост, оборванный прошлым проходом: от сохранённого токена до старой границы
+    if cursor.gap_token is not None:
+        gap, status, token = scrape_reviews_since(
+            app_id,
+            lang=lang,
+            country=country,
+            since_review_id=cursor.gap_until_review_id,
+            since_date=cursor.gap_until_date,
+            max_count=budget,
+            continuation_token=continuation_token_from_dict(cursor.gap_token),
+        )
+        out.extend(gap)
+        if status in ("reached", "end"):
+            cursor = replace(cursor, gap_token=None, gap_until_review_id=None, gap_until_date=None)
+        elif status == "truncated":
+            cursor = replace(cursor, gap_token=continuation_token_to_dict(token))
+        # broken: токен не двигаем, следующий прогон повторит тот же участок
+        if cursor.gap_token is not None:
+            return out, cursor
+        budget -= len(gap)
+        if budget <= 0:
+            return out, cursor
+
+    head, status, token = scrape_reviews_since(
+        app_id,
+        lang=lang,
+        country=country,
+        since_review_id=cursor.hwm_review_id,
+        since_date=cursor.hwm_date,
+        max_count=budget,
+    )
+    out.extend(head)
+    # Лента оборвалась до границы — HWM не трогаем, иначе пропущенное уже не дочитать
+    if status == "broken" or not head:
+        return out, cursor
+    if status == "truncated" and cursor.hwm_date is not None:
+        cursor = replace(
+            cursor,
+            gap_token=continuation_token_to_dict(token),
+            gap_until_review_id=cursor.hwm_review_id,
+            gap_until_date=cursor.hwm_date,
+        )
+    return out, replace(cursor, hwm_review_id=head[0]["review_id"], hwm_date=head[0]["date"])
+
+
+def _write_meta(
+    uow,
+    *,
+    app_id: str,
+    lang: str,
+    country: str,
+    scraped_meta,
+    dev,
+    permissions: list[dict[str, Any]],
+) -> MetaInfo:
+    if dev is not None:
+        uow.upsert_developer(
+            developer_key=dev.developer_key,
+            name=dev.name,
+            email=dev.email,
+            website=dev.website,
+            address=dev.address,
+        )
+    meta_row = uow.upsert_meta_info(_meta_to_db(scraped_meta, lang=lang, country=country))
+    if permissions:
+        uow.replace_permissions(app_id=app_id, permissions=permissions)
+    return meta_row
+
+
+def _refresh_app(
+    db: Database,
+    *,
+    app_id: str,
+    lang: str,
+    country: str,
+    write_permissions: bool = True,
+) -> tuple[MetaInfo, int]:
+    scraped_meta, dev, permissions = scrape_app_meta(app_id, lang=lang, country=country)
+    reviews, cursor = _scrape_new_reviews(db, app_id=app_id, lang=lang, country=country)
+
+    inserted_reviews = 0
+    with db.unit_of_work() as uow:
+        meta_row = _write_meta(
+            uow,
+            app_id=app_id,
+            lang=lang,
+            country=country,
+            scraped_meta=scraped_meta,
+            dev=dev,
+            permissions=permissions if write_permissions else [],
+        )
+        if reviews:
+            inserted_reviews = uow.insert_reviews(app_id=app_id, reviews=reviews, lang=lang, country=country)
+        if cursor is not None:
+            uow.save_review_cursor(cursor)
+
+    return meta_row, inserted_reviews
+
+
+def _refresh_meta(db: Database, *, app_id: str, lang: str, country: str) -> MetaInfo:
+    scraped_meta, dev, permissions = scrape_app_meta(app_id, lang=lang, country=country)
+    with db.unit_of_work() as uow:
+        return _write_meta(
+            uow,
+            app_id=app_id,
+            lang=lang,
+            country=country,
+            scraped_meta=scraped_meta,
+            dev=dev,
+            permissions=permissions,
+        )
+
+
+def _refresh_reviews(db: Database, *, app_id: str, lang: str, country: str) -> tuple[int, float]:
+    started = time.perf_counter()
+    reviews, cursor = _scrape_new_reviews(db, app_id=app_id, lang=lang, country=country)
+    inserted_reviews = 0
+    with db.unit_of_work() as uow:
+        if reviews:
+            inserted_reviews = uow.insert_reviews(app_id=app_id, reviews=reviews, lang=lang, country=country)
+        if cursor is not None:
+            uow.save_review_cursor(cursor)
+    return inserted_reviews, time.perf_counter() - started
+
+
+@contextmanager
+def _timed(timings: dict[str, float], stage: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round(time.perf_counter() - started, 3)
+
+
+def _join_reviews(future: Future, timings: dict[str, float]) -> str | None:
+    started = time.perf_counter()
+    try:
+        _, elapsed = future.result()
+    except Exception as e:  # noqa: BLE001
+        # Ошибка отзывов не должна терять анализ: отпечаток считается по уже сохранённым отзывам
+        timings["reviews_wait"] = round(time.perf_counter() - started, 3)
+        return str(e)
+    timings["reviews"] = round(elapsed, 3)
+    timings["reviews_wait"] = round(time.perf_counter() - started, 3)
+    return None
+
+
+def _input_fingerprint(db: Database, meta_row: MetaInfo, *, user_context: str | None) -> dict[str, Any]:
+    digest = db.get_review_digest(
+        app_id=meta_row.app_id,
+        window=timedelta(days=ANALYSIS_FP_REVIEW_WINDOW_DAYS),
+        lang=meta_row.lang,
+        country=meta_row.country,
+    )
+    return build_fingerprint(
+        meta_row, digest, user_context=user_context, model=_model(), prompt_template=prompt_template_hash()
+    )
+
+
+def _cached_analysis(db: Database, *, app_id: str, lang: str, country: str, latest: AnalysisRow) -> dict[str, Any]:
+    meta_row = db.get_meta_info(
+        app_id=app_id, lang=lang, country=country, max_age=timedelta(days=META_MAX_AGE_DAYS)
+    )
+    return {
+        "source": "analysis_cache",
+        "meta": asdict(meta_row) if meta_row else None,
+        "analysis": {
+            "market_fit": latest.market_fit,
+            "recommendations": latest.recommendations,
+            "raw": latest.raw_llm_response,
+            "analyzed_at": latest.analyzed_at.isoformat(),
+        },
+    }
+
+
+def enqueue_analysis(
     *,
     app_id: str,
     scenario: str,
@@ -56,63 +277,296 @@ def run_user_pipeline(
     client_id: str | None,
     lang: str = "en",
     country: str = "us",
-) -> dict[str, Any]:
-    db = Database()
+    allow_stale: bool = True,
+) -> str:
+    params = {
+        "app_id": app_id,
+        "scenario": scenario,
+        "user_context": user_context,
+        "client_id": client_id,
+        "lang": lang,
+        "country": country,
+        "allow_stale": allow_stale,
+    }
+    dedupe_key = (
+        f"analysis:{app_id}:{lang}:{country}:{scenario}:{client_id or ''}:{'stale' if allow_stale else 'fresh'}"
+    )
+    return Database().enqueue_job(kind="analysis", params=params, dedupe_key=dedupe_key)
+
 
+def get_job_status(job_id: str) -> dict[str, Any]:
+    job = Database().get_job(job_id=job_id)
+    if job is None:
+        return {"status": "missing"}
+    return {"status": job.status, "result": job.result, "error": job.error, "progress": job.progress}
+
+
+def _lookup_cached(
+    db: Database,
+    *,
+    app_id: str,
+    scenario: str,
+    user_context: str | None,
+    client_id: str | None,
+    lang: str,
+    country: str,
+    allow_stale: bool,
+) -> dict[str, Any] | None:
     analysis_max_age = timedelta(days=ANALYSIS_MAX_AGE_DAYS)
-    meta_max_age = timedelta(days=META_MAX_AGE_DAYS)
+    analysis_max_stale = timedelta(days=max(ANALYSIS_MAX_STALE_DAYS, ANALYSIS_MAX_AGE_DAYS))
 
-    latest = db.get_latest_analysis(app_id=app_id, scenario=scenario, client_id=client_id)
-    if latest and is_fresh(latest.analyzed_at, max_age=analysis_max_age):
-        return {
-            "source": "analysis_cache",
-            "meta": asdict(db.get_meta_info(app_id=app_id)) if db.get_meta_info(app_id=app_id) else None,
-            "analysis": {
-                "market_fit": latest.market_fit,
-                "recommendations": latest.recommendations,
-                "raw": latest.raw_llm_response,
-                "analyzed_at": latest.analyzed_at.isoformat(),
-            },
-        }
+    latest = db.get_latest_analysis(
+        app_id=app_id,
+        scenario=scenario,
+        client_id=client_id,
+        lang=lang,
+        country=country,
+        max_age=analysis_max_age,
+    )
+    if latest and is_fresh(latest.fresh_since, max_age=analysis_max_age):
+        return _cached_analysis(db, app_id=app_id, lang=lang, country=country, latest=latest)
 
-    meta_row = db.get_meta_info(app_id=app_id)
-    meta_is_fresh = meta_row is not None and is_fresh(meta_row.last_scraped, max_age=meta_max_age)
-
-    if not meta_is_fresh:
-        scraped_meta, dev, permissions = scrape_app_meta(app_id, lang=lang, country=country)
-        if dev is not None:
-            db.upsert_developer(
-                developer_key=dev.developer_key,
-                name=dev.name,
-                email=dev.email,
-                website=dev.website,
-                address=dev.address,
-            )
-        db.upsert_meta_info(_meta_to_db(scraped_meta))
-        if permissions:
-            db.replace_permissions(app_id=app_id, permissions=permissions)
-        meta_row = db.get_meta_info(app_id=app_id)
+    if allow_stale and latest and is_fresh(latest.fresh_since, max_age=analysis_max_stale):
+        refresh_job_id = enqueue_analysis(
+            app_id=app_id,
+            scenario=scenario,
+            user_context=user_context,
+            client_id=client_id,
+            lang=lang,
+            country=country,
+            allow_stale=False,
+        )
+        result = _cached_analysis(db, app_id=app_id, lang=lang, country=country, latest=latest)
+        result["source"] = "analysis_stale"
+        result["stale"] = True
+        result["refresh_job_id"] = refresh_job_id
+        return result
 
-        reviews = scrape_reviews(app_id, lang=lang, country=country, count=REVIEWS_COUNT)
-        if reviews:
-            db.insert_reviews(app_id=app_id, reviews=reviews)
+    return None
+
+
+def get_cached_result(
+    *,
+    app_id: str,
+    scenario: str,
+    user_context: str | None,
+    client_id: str | None,
+    lang: str = "en",
+    country: str = "us",
+) -> dict[str, Any] | None:
+    return _lookup_cached(
+        Database(),
+        app_id=app_id,
+        scenario=scenario,
+        user_context=user_context,
+        client_id=client_id,
+        lang=lang,
+        country=country,
+        allow_stale=True,
+    )
+
+
+def run_user_pipeline(
+    *,
+    app_id: str,
+    scenario: str,
+    user_context: str | None,
+    client_id: str | None,
+    lang: str = "en",
+    country: str = "us",
+    allow_stale: bool = True,
+    on_progress: Callable[[dict[str, Any]], None] | None = None,
+) -> dict[str, Any]:
+    key = (app_id, lang, country, scenario, client_id or "", allow_stale)
+    with _INFLIGHT_LOCK:
+        future = _INFLIGHT.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _INFLIGHT[key] = future
+
+    if not is_leader:
+        return future.result()
 
-    meta_payload = asdict(meta_row) if meta_row else {"app_id": app_id}
+    try:
+        result = _run_user_pipeline(
+            app_id=app_id,
+            scenario=scenario,
+            user_context=user_context,
+            client_id=client_id,
+            lang=lang,
+            country=country,
+            allow_stale=allow_stale,
+            on_progress=on_progress,
+        )
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT.pop(key, None)
 
-    result = analyze_app(app_id=app_id, meta=meta_payload, scenario=scenario, user_context=user_context)
 
-    db.insert_analysis(
+def _lock_timeout_result(
+    db: Database, *, app_id: str, scenario: str, client_id: str | None, lang: str, country: str
+) -> dict[str, Any]:
+    analysis_max_age = timedelta(days=ANALYSIS_MAX_AGE_DAYS)
+    analysis_max_stale = timedelta(days=max(ANALYSIS_MAX_STALE_DAYS, ANALYSIS_MAX_AGE_DAYS))
+    latest = db.get_latest_analysis(
         app_id=app_id,
+        scenario=scenario,
         client_id=client_id,
+        lang=lang,
+        country=country,
+        max_age=analysis_max_age,
+    )
+    if latest and is_fresh(latest.fresh_since, max_age=analysis_max_age):
+        return _cached_analysis(db, app_id=app_id, lang=lang, country=country, latest=latest)
+    if latest and is_fresh(latest.fresh_since, max_age=analysis_max_stale):
+        result = _cached_analysis(db, app_id=app_id, lang=lang, country=country, latest=latest)
+        result["source"] = "analysis_stale"
+        result["stale"] = True
+        return result
+    raise RuntimeError(
+        f"Analysis for {app_id} ({lang}/{country}, {scenario}) is still running elsewhere; "
+        f"lock not acquired in {ANALYSIS_LOCK_TIMEOUT_SEC}s"
+    )
+
+
+def _run_user_pipeline(
+    *,
+    app_id: str,
+    scenario: str,
+    user_context: str | None,
+    client_id: str | None,
+    lang: str,
+    country: str,
+    allow_stale: bool,
+    on_progress: Callable[[dict[str, Any]], None] | None = None,
+) -> dict[str, Any]:
+    db = Database()
+    report = on_progress or (lambda _progress: None)
+
+    analysis_max_age = timedelta(days=ANALYSIS_MAX_AGE_DAYS)
+    meta_max_age = timedelta(days=META_MAX_AGE_DAYS)
+
+    cached = _lookup_cached(
+        db,
+        app_id=app_id,
         scenario=scenario,
         user_context=user_context,
-        prompt_used=result.prompt_used,
-        market_fit=result.market_fit,
-        recommendations=result.recommendations,
-        raw_llm_response=result.raw,
+        client_id=client_id,
+        lang=lang,
+        country=country,
+        allow_stale=allow_stale,
     )
+    if cached is not None:
+        return cached
 
-    return {
+    timings: dict[str, float] = {}
+    started = time.perf_counter()
+
+    lock_key = f"analysis:{app_id}:{lang}:{country}:{scenario}:{client_id or ''}"
+    with db.advisory_lock(lock_key, timeout_sec=ANALYSIS_LOCK_TIMEOUT_SEC) as acquired:
+        if not acquired:
+            # Лидер ещё считает: второй анализ не запускаем, отдаём что есть или падаем
+            return _lock_timeout_result(
+                db, app_id=app_id, scenario=scenario, client_id=client_id, lang=lang, country=country
+            )
+        latest = db.get_latest_analysis(
+            app_id=app_id,
+            scenario=scenario,
+            client_id=client_id,
+            lang=lang,
+            country=country,
+            max_age=analysis_max_age,
+        )
+        if latest and is_fresh(latest.fresh_since, max_age=analysis_max_age):
+            return _cached_analysis(db, app_id=app_id, lang=lang, country=country, latest=latest)
+
+        meta_row = db.get_meta_info(app_id=app_id, lang=lang, country=country, max_age=meta_max_age)
+        meta_is_fresh = meta_row is not None and is_fresh(meta_row.last_scraped, max_age=meta_max_age)
+
+        reviews_future: Future | None = None
+        review_error: str | None = None
+        if not meta_is_fresh:
+            report({"stage": "scraping"})
+            if PIPELINE_OVERLAP:
+                with _timed(timings, "meta"):
+                    meta_row = _refresh_meta(db, app_id=app_id, lang=lang, country=country)
+                reviews_future = _REVIEW_EXECUTOR.submit(
+                    _refresh_reviews, db, app_id=app_id, lang=lang, country=country
+                )
+            else:
+                with _timed(timings, "refresh"):
+                    meta_row, _ = _refresh_app(db, app_id=app_id, lang=lang, country=country)
+
+        # Если мета не изменилась, нужен ли анализ — решают свежие отзывы; ждём их
+        if reviews_future is not None and latest and not meta_changed(latest.input_fingerprint, meta_row):
+            review_error = _join_reviews(reviews_future, timings)
+            reviews_future = None
+
+        fingerprint = None
+        if reviews_future is None:
+            fingerprint = _input_fingerprint(db, meta_row, user_context=user_context) if meta_row else None
+            if latest and fingerprint and not changed_fields(latest.input_fingerprint, fingerprint):
+                db.revalidate_analysis(analysis_id=latest.id)
+                result = _cached_analysis(db, app_id=app_id, lang=lang, country=country, latest=latest)
+                result["source"] = "analysis_revalidated"
+                if review_error:
+                    result["review_error"] = review_error
+                timings["total"] = round(time.perf_counter() - started, 3)
+                result["timings_sec"] = timings
+                return result
+
+        meta_payload = asdict(meta_row) if meta_row else {"app_id": app_id}
+
+        streamed: list[str] = []
+
+        def on_recommendation(text: str) -> None:
+            streamed.append(text)
+            report({"stage": "analyzing", "recommendations": list(streamed)})
+
+        report({"stage": "analyzing", "recommendations": []})
+        try:
+            with _timed(timings, "llm"):
+                result = analyze_app(
+                    app_id=app_id,
+                    meta=meta_payload,
+                    scenario=scenario,
+                    user_context=user_context,
+                    on_recommendation=on_recommendation,
+                )
+        except Exception:
+            if reviews_future is not None:
+                reviews_future.exception()
+            raise
+
+        if reviews_future is not None:
+            review_error = _join_reviews(reviews_future, timings)
+            fingerprint = _input_fingerprint(db, meta_row, user_context=user_context)
+
+        with _timed(timings, "store_analysis"):
+            db.insert_analysis(
+                app_id=app_id,
+                client_id=client_id,
+                scenario=scenario,
+                user_context=user_context,
+                prompt_used=result.prompt_used,
+                market_fit=result.market_fit,
+                recommendations=result.recommendations,
+                raw_llm_response=result.raw,
+                input_fingerprint=fingerprint,
+                prompt_tokens_est=result.prompt_tokens_est,
+                lang=lang,
+                country=country,
+            )
+
+    timings["total"] = round(time.perf_counter() - started, 3)
+    out = {
         "source": "fresh_analysis",
         "meta": meta_payload,
         "analysis": {
@@ -120,34 +574,290 @@ def run_user_pipeline(
             "recommendations": result.recommendations,
             "raw": result.raw,
         },
+        "timings_sec": timings,
     }
+    if review_error:
+        out["review_error"] = review_error
+    return out
 
 
-def run_cron_refresh(*, app_id: str, lang: str = "en", country: str = "us") -> dict[str, Any]:
+def reanalyze_apps(
+    *,
+    app_ids: list[str],
+    scenario: str,
+    user_context: str | None = None,
+    client_id: str | None = None,
+    lang: str = "en",
+    country: str = "us",
+) -> list[dict[str, Any]]:
     db = Database()
+    analysis_max_age = timedelta(days=ANALYSIS_MAX_AGE_DAYS)
     meta_max_age = timedelta(days=META_MAX_AGE_DAYS)
 
-    meta_row = db.get_meta_info(app_id=app_id)
-    meta_is_fresh = meta_row is not None and is_fresh(meta_row.last_scraped, max_age=meta_max_age)
-    if meta_is_fresh:
-        return {"app_id": app_id, "status": "skipped_fresh"}
+    out: list[dict[str, Any]] = []
+    items: list[dict[str, Any]] = []
+    for app_id in app_ids:
+        meta_row = db.get_meta_info(app_id=app_id, lang=lang, country=country, max_age=meta_max_age)
+        if meta_row is None:
+            out.append({"app_id": app_id, "status": "skipped_no_meta"})
+            continue
 
-    scraped_meta, dev, permissions = scrape_app_meta(app_id, lang=lang, country=country)
-    if dev is not None:
-        db.upsert_developer(
-            developer_key=dev.developer_key,
-            name=dev.name,
-            email=dev.email,
-            website=dev.website,
-            address=dev.address,
+        fingerprint = _input_fingerprint(db, meta_row, user_context=user_context)
+        latest = db.get_latest_analysis(
+            app_id=app_id,
+            scenario=scenario,
+            client_id=client_id,
+            lang=lang,
+            country=country,
+            max_age=analysis_max_age,
         )
-    db.upsert_meta_info(_meta_to_db(scraped_meta))
-    if permissions:
-        db.replace_permissions(app_id=app_id, permissions=permissions)
+        if latest and not changed_fields(latest.input_fingerprint, fingerprint):
+            db.revalidate_analysis(analysis_id=latest.id)
+            out.append({"app_id": app_id, "status": "revalidated"})
+            continue
 
-    reviews = scrape_reviews(app_id, lang=lang, country=country, count=REVIEWS_COUNT)
-    inserted_reviews = 0
-    if reviews:
-        inserted_reviews = db.insert_reviews(app_id=app_id, reviews=reviews)
+        items.append(
+            {
+                "app_id": app_id,
+                "meta": asdict(meta_row),
+                "scenario": scenario,
+                "user_context": user_context,
+                "fingerprint": fingerprint,
+            }
+        )
+
+    results = asyncio.run(analyze_apps(items))
+
+    for item, result in zip(items, results):
+        if isinstance(result, Exception):
+            out.append({"app_id": item["app_id"], "status": "error", "error": str(result)})
+            continue
+        db.insert_analysis(
+            app_id=item["app_id"],
+            client_id=client_id,
+            scenario=scenario,
+            user_context=user_context,
+            prompt_used=result.prompt_used,
+            market_fit=result.market_fit,
+            recommendations=result.recommendations,
+            raw_llm_response=result.raw,
+            input_fingerprint=item["fingerprint"],
+            prompt_tokens_est=result.prompt_tokens_est,
+            lang=lang,
+            country=country,
+        )
+        out.append({"app_id": item["app_id"], "status": "analyzed", "market_fit": result.market_fit})
+
+    return out
+
+
+def _batch_refresh_one(db: Database, *, app_id: str, lang: str, country: str) -> MetaInfo:
+    meta_max_age = timedelta(days=META_MAX_AGE_DAYS)
+    meta_row = db.get_meta_info(app_id=app_id, lang=lang, country=country, max_age=meta_max_age)
+    if meta_row is not None and is_fresh(meta_row.last_scraped, max_age=meta_max_age):
+        return meta_row
+    meta_row, _ = _refresh_app(db, app_id=app_id, lang=lang, country=country)
+    return meta_row
+
+
+def run_batch_pipeline(
+    *,
+    app_ids: list[str],
+    scenario: str,
+    user_context: str | None = None,
+    client_id: str | None = None,
+    lang: str = "en",
+    country: str = "us",
+) -> list[dict[str, Any]]:
+    db = Database()
+    analysis_max_age = timedelta(days=ANALYSIS_MAX_AGE_DAYS)
+    app_ids = list(dict.fromkeys(app_ids))
+
+    out: dict[str, dict[str, Any]] = {}
+    meta_rows: dict[str, MetaInfo] = {}
+    with ThreadPoolExecutor(max_workers=max(1, BATCH_SCRAPE_WORKERS)) as executor:
+        futures = {
+            app_id: executor.submit(_batch_refresh_one, db, app_id=app_id, lang=lang, country=country)
+            for app_id in app_ids
+        }
+        for app_id, future in futures.items():
+            try:
+                meta_rows[app_id] = future.result()
+            except Exception as e:  # noqa: BLE001
+                out[app_id] = {"app_id": app_id, "status": "error", "stage": "scrape", "error": str(e)}
+
+    items: list[dict[str, Any]] = []
+    for app_id, meta_row in meta_rows.items():
+        latest = db.get_latest_analysis(
+            app_id=app_id,
+            scenario=scenario,
+            client_id=client_id,
+            lang=lang,
+            country=country,
+            max_age=analysis_max_age,
+        )
+        if latest and is_fresh(latest.fresh_since, max_age=analysis_max_age):
+            out[app_id] = {"app_id": app_id, "status": "cached", "market_fit": latest.market_fit}
+            continue
+
+        fingerprint = _input_fingerprint(db, meta_row, user_context=user_context)
+        if latest and not changed_fields(latest.input_fingerprint, fingerprint):
+            db.revalidate_analysis(analysis_id=latest.id)
+            out[app_id] = {"app_id": app_id, "status": "revalidated", "market_fit": latest.market_fit}
+            continue
+
+        items.append(
+            {
+                "app_id": app_id,
+                "meta": asdict(meta_row),
+                "scenario": scenario,
+                "user_context": user_context,
+                "fingerprint": fingerprint,
+            }
+        )
 
-    return {"app_id": app_id, "status": "refreshed", "inserted_reviews": inserted_reviews}
+    results: dict[str, Any] = {}
+    batch_errors: dict[str, str] = {}
+    batch_size = max(1, LLM_BATCH_SIZE)
+    for i in range(0, len(items), batch_size):
+        chunk = items[i : i + batch_size]
+        try:
+            results.update(analyze_batch(items=chunk, scenario=scenario, user_context=user_context))
+        except Exception as e:  # noqa: BLE001
+            batch_errors.update({item["app_id"]: str(e) for item in chunk})
+
+    # Приложения, которых нет в разобранном ответе пакета, анализируем по одному
+    fallback = [item for item in items if item["app_id"] not in results]
+    fallback_ids = {item["app_id"] for item in fallback}
+    if fallback:
+        for item, result in zip(fallback, asyncio.run(analyze_apps(fallback))):
+            results[item["app_id"]] = result
+
+    for item in items:
+        app_id = item["app_id"]
+        result = results[app_id]
+        if isinstance(result, Exception):
+            out[app_id] = {"app_id": app_id, "status": "error", "stage": "analyze", "error": str(result)}
+            if app_id in batch_errors:
+                out[app_id]["batch_error"] = batch_errors[app_id]
+            continue
+        db.insert_analysis(
+            app_id=app_id,
+            client_id=client_id,
+            scenario=scenario,
+            user_context=user_context,
+            prompt_used=result.prompt_used,
+            market_fit=result.market_fit,
+            recommendations=result.recommendations,
+            raw_llm_response=result.raw,
+            input_fingerprint=item["fingerprint"],
+            prompt_tokens_est=result.prompt_tokens_est,
+            lang=lang,
+            country=country,
+        )
+        out[app_id] = {
+            "app_id": app_id,
+            "status": "analyzed",
+            "mode": "single" if app_id in fallback_ids else "batch",
+            "market_fit": result.market_fit,
+        }
+        if app_id in batch_errors:
+            out[app_id]["batch_error"] = batch_errors[app_id]
+
+    return [out[app_id] for app_id in app_ids]
+
+
+def parse_locales(value: str | None) -> list[tuple[str, str]]:
+    locales: list[tuple[str, str]] = []
+    for item in (value or "").split(","):
+        lang, _, country = item.strip().partition(":")
+        if lang and country and (lang, country) not in locales:
+            locales.append((lang, country))
+    return locales
+
+
+def _lease_heartbeat(
+    db: Database, *, app_id: str, owner: str, stop: threading.Event, errors: list[str]
+) -> None:
+    # Обновление нескольких локалей с ретраями и лимитером может идти дольше REFRESH_LEASE_SEC
+    while not stop.wait(REFRESH_HEARTBEAT_SEC):
+        try:
+            if not db.renew_app_lease(app_id=app_id, owner=owner, lease_seconds=REFRESH_LEASE_SEC):
+                errors.append("lease_lost")
+                return
+        except Exception as e:  # noqa: BLE001
+            errors.append(str(e))
+
+
+def run_cron_refresh(
+    *,
+    app_id: str,
+    lang: str = "en",
+    country: str = "us",
+    locales: list[tuple[str, str]] | None = None,
+    check_fresh: bool = True,
+    lease_owner: str | None = None,
+) -> dict[str, Any]:
+    db = Database()
+    meta_max_age = timedelta(days=META_MAX_AGE_DAYS)
+    locales = locales or [(lang, country)]
+
+    if check_fresh:
+        stale_locales = []
+        for loc_lang, loc_country in locales:
+            meta_row = db.get_meta_info(app_id=app_id, lang=loc_lang, country=loc_country, max_age=meta_max_age)
+            if meta_row is None or not is_fresh(meta_row.last_scraped, max_age=meta_max_age):
+                stale_locales.append((loc_lang, loc_country))
+        if not stale_locales:
+            return {"app_id": app_id, "status": "skipped_fresh"}
+        locales = stale_locales
+
+    owns_lease = lease_owner is None
+    if owns_lease:
+        lease_owner = new_lease_owner()
+        if not db.claim_apps(owner=lease_owner, app_ids=[app_id], lease_seconds=REFRESH_LEASE_SEC):
+            return {"app_id": app_id, "status": "skipped_leased"}
+
+    stop = threading.Event()
+    lease_errors: list[str] = []
+    heartbeat = threading.Thread(
+        target=_lease_heartbeat,
+        kwargs={"db": db, "app_id": app_id, "owner": lease_owner, "stop": stop, "errors": lease_errors},
+        daemon=True,
+    )
+    heartbeat.start()
+    try:
+        if len(locales) == 1:
+            _, inserted_reviews = _refresh_app(db, app_id=app_id, lang=locales[0][0], country=locales[0][1])
+            inserted_by_locale = {f"{locales[0][0]}-{locales[0][1]}": inserted_reviews}
+        else:
+            # Локали одного приложения тянем параллельно; общий GPLAY_LIMITER держит суммарный темп.
+            # Разрешения пишет только первая локаль, чтобы параллельные DELETE+INSERT не задваивали строки.
+            with ThreadPoolExecutor(max_workers=max(1, min(LOCALE_FANOUT_WORKERS, len(locales)))) as executor:
+                futures = {
+                    f"{loc_lang}-{loc_country}": executor.submit(
+                        _refresh_app,
+                        db,
+                        app_id=app_id,
+                        lang=loc_lang,
+                        country=loc_country,
+                        write_permissions=i == 0,
+                    )
+                    for i, (loc_lang, loc_country) in enumerate(locales)
+                }
+                inserted_by_locale = {key: future.result()[1] for key, future in futures.items()}
+    finally:
+        stop.set()
+        heartbeat.join()
+        if owns_lease:
+            db.release_app_lease(app_id=app_id, owner=lease_owner)
+
+    result = {
+        "app_id": app_id,
+        "status": "refreshed",
+        "inserted_reviews": sum(inserted_by_locale.values()),
+        "locales": inserted_by_locale,
+    }
+    if lease_errors:
+        result["lease_errors"] = lease_errors
+    return result
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any
+
+from config import get_env_int
+
+
+LLM_PROMPT_TOKEN_BUDGET = get_env_int("LLM_PROMPT_TOKEN_BUDGET", 1200)
+LLM_BATCH_APP_TOKEN_BUDGET = get_env_int("LLM_BATCH_APP_TOKEN_BUDGET", 600)
+
+# Ссылки на картинки/видео и служебные метки времени ничего не дают анализу, но съедают токены.
+_DROP_FIELDS = ("last_scraped", "url", "icon", "header_image", "screenshots", "video")
+_TRUNCATE_ORDER = ("description", "summary")
+
+PROMPT_INSTRUCTIONS = (
+    "You are a product analyst. Return JSON only (no markdown, no code fences). "
+    "Schema: {\"market_fit\": int 0..10, \"recommendations\": [string], \"notes\": string}. "
+)
+
+BATCH_PROMPT_INSTRUCTIONS = (
+    "You are a product analyst. Analyze each app below independently. Return JSON only (no markdown, no code fences). "
+    "Schema: {\"apps\": [{\"app_id\": string, \"market_fit\": int 0..10, \"recommendations\": [string], "
+    "\"notes\": string}]}. Return exactly one entry per app id, using the app ids as given. "
+)
+
+# Поднимать при правке текста шаблонов вне *_INSTRUCTIONS (_render, build_batch_prompt)
+PROMPT_TEMPLATE_VERSION = 1
+
+
+def prompt_template_hash() -> str:
+    # Одиночный и пакетный промпты взаимозаменяемы (пакет падает в одиночный), поэтому хэш общий
+    raw = f"{PROMPT_TEMPLATE_VERSION}\n{PROMPT_INSTRUCTIONS}\n{BATCH_PROMPT_INSTRUCTIONS}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class BuiltPrompt:
+    text: str
+    token_estimate: int
+    truncated_fields: list[str]
+
+
+def json_default(obj: Any):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return str(obj)
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, (len(text) + 3) // 4)
+
+
+def compact_meta(meta: dict[str, Any]) -> dict[str, Any]:
+    out = {k: v for k, v in meta.items() if k not in _DROP_FIELDS and v is not None and v != ""}
+    screenshots = meta.get("screenshots")
+    if isinstance(screenshots, list) and screenshots:
+        out["screenshots_count"] = len(screenshots)
+    if meta.get("video"):
+        out["has_video"] = True
+    for field in _TRUNCATE_ORDER:
+        if isinstance(out.get(field), str):
+            out[field] = " ".join(out[field].split())
+    return out
+
+
+def _render(*, app_id: str, meta: dict[str, Any], scenario: str, user_context: str | None) -> str:
+    return (
+        PROMPT_INSTRUCTIONS
+        + f"Scenario: {scenario}. "
+        f"User context: {user_context or ''}. "
+        f"App id: {app_id}. "
+        "App data: "
+        + json.dumps(meta, ensure_ascii=False, default=json_default)
+    )
+
+
+def _fit_budget(compact: dict[str, Any], render, token_budget: int) -> tuple[str, list[str]]:
+    text = render(compact)
+    truncated: list[str] = []
+
+    for field in _TRUNCATE_ORDER:
+        over_chars = (estimate_tokens(text) - token_budget) * 4
+        if over_chars <= 0:
+            break
+        value = compact.get(field)
+        if not isinstance(value, str) or not value:
+            continue
+        keep = max(0, len(value) - over_chars - 1)
+        compact[field] = value[:keep].rstrip() + "…"
+        truncated.append(field)
+        text = render(compact)
+
+    return text, truncated
+
+
+def build_analysis_prompt(
+    *,
+    app_id: str,
+    meta: dict[str, Any],
+    scenario: str,
+    user_context: str | None,
+    token_budget: int = LLM_PROMPT_TOKEN_BUDGET,
+) -> BuiltPrompt:
+    text, truncated = _fit_budget(
+        compact_meta(meta),
+        lambda compact: _render(app_id=app_id, meta=compact, scenario=scenario, user_context=user_context),
+        token_budget,
+    )
+    return BuiltPrompt(text=text, token_estimate=estimate_tokens(text), truncated_fields=truncated)
+
+
+def build_batch_prompt(
+    *,
+    apps: list[tuple[str, dict[str, Any]]],
+    scenario: str,
+    user_context: str | None,
+    app_token_budget: int = LLM_BATCH_APP_TOKEN_BUDGET,
+) -> BuiltPrompt:
+    entries: list[str] = []
+    truncated: list[str] = []
+    for app_id, meta in apps:
+        entry, app_truncated = _fit_budget(
+            {"app_id": app_id, **compact_meta(meta)},
+            lambda compact: json.dumps(compact, ensure_ascii=False, default=json_default),
+            app_token_budget,
+        )
+        entries.append(entry)
+        truncated.extend(f"{app_id}.{field}" for field in app_truncated)
+
+    text = (
+        BATCH_PROMPT_INSTRUCTIONS
+        + f"Scenario: {scenario}. "
+        f"User context: {user_context or ''}. "
+        "Apps: ["
+        + ", ".join(entries)
+        + "]"
+    )
+    return BuiltPrompt(text=text, token_estimate=estimate_tokens(text), truncated_fields=truncated)
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from cache import TTLCache
+from config import get_env_float, get_env_int
+from db import DEFAULT_COUNTRY, DEFAULT_LANG, Database, utcnow
+
+
+REVIEW_ANALYTICS_WINDOW_DAYS = get_env_int("REVIEW_ANALYTICS_WINDOW_DAYS", 365)
+REVIEW_ANALYTICS_MAX_VERSIONS = get_env_int("REVIEW_ANALYTICS_MAX_VERSIONS", 30)
+REVIEW_ANALYTICS_CACHE_ENTRIES = get_env_int("REVIEW_ANALYTICS_CACHE_ENTRIES", 256)
+REVIEW_ANALYTICS_CACHE_TTL_SEC = get_env_float("REVIEW_ANALYTICS_CACHE_TTL_SEC", 900.0)
+
+SCORES = [1, 2, 3, 4, 5]
+
+# Вся агрегация — в Postgres: в Python приезжает ~недели×5 строк, а не сами отзывы.
+# Вес отзыва для взвешенной оценки — 1 + thumbs_up, чтобы отзывы без лайков тоже учитывались.
+_WEEKLY_SQL = """
+    SELECT date_trunc('week', date) AS week,
+           score,
+           COUNT(*) AS n,
+           COALESCE(SUM(thumbs_up), 0) AS thumbs,
+           COUNT(replied_at) AS replied,
+           COALESCE(SUM(EXTRACT(EPOCH FROM replied_at - date)) FILTER (WHERE replied_at >= date), 0) AS reply_sec,
+           COUNT(*) FILTER (WHERE replied_at >= date) AS reply_timed
+    FROM app_reviews
+    WHERE app_id = %s AND lang = %s AND country = %s AND date >= %s AND score BETWEEN 1 AND 5
+    GROUP BY 1, 2
+"""
+
+_VERSION_SQL = """
+    SELECT COALESCE(version, 'unknown') AS version,
+           COUNT(*) AS n,
+           AVG(score) AS avg_score,
+           SUM(score * (1 + COALESCE(thumbs_up, 0)))::float / SUM(1 + COALESCE(thumbs_up, 0)) AS weighted_score,
+           COUNT(replied_at)::float / COUNT(*) AS reply_rate,
+           MIN(date) AS first_seen,
+           MAX(date) AS last_seen
+    FROM app_reviews
+    WHERE app_id = %s AND lang = %s AND country = %s AND date >= %s AND score BETWEEN 1 AND 5
+    GROUP BY 1
+    ORDER BY last_seen DESC
+    LIMIT %s
+"""
+
+_REPLY_LATENCY_SQL = """
+    SELECT percentile_cont(ARRAY[0.5, 0.9]) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM replied_at - date))
+    FROM app_reviews
+    WHERE app_id = %s AND lang = %s AND country = %s AND date >= %s AND replied_at >= date
+"""
+
+_CACHE = TTLCache(max_entries=REVIEW_ANALYTICS_CACHE_ENTRIES, ttl_sec=REVIEW_ANALYTICS_CACHE_TTL_SEC)
+
+
+@dataclass
+class ReviewAnalytics:
+    app_id: str
+    lang: str
+    country: str
+    since: datetime
+    computed_at: datetime
+    summary: dict[str, Any]
+    # index: week; n, weight, avg_score, weighted_score, reply_rate, avg_reply_hours, share_1..share_5
+    weekly: pd.DataFrame
+    # index: version; n, avg_score, weighted_score, reply_rate, first_seen, last_seen
+    by_version: pd.DataFrame
+
+
+def _weekly_frame(rows: list[tuple]) -> pd.DataFrame:
+    raw = pd.DataFrame(rows, columns=["week", "score", "n", "thumbs", "replied", "reply_sec", "reply_timed"])
+    if raw.empty:
+        return pd.DataFrame(
+            columns=["n", "weight", "avg_score", "weighted_score", "reply_rate", "avg_reply_hours"]
+            + [f"share_{s}" for s in SCORES]
+        )
+    raw = raw.astype(
+        {"score": "int64", "n": "int64", "thumbs": "int64", "replied": "int64", "reply_sec": "float64"}
+    )
+    raw["week"] = pd.to_datetime(raw["week"], utc=True)
+    raw["weight"] = raw["n"] + raw["thumbs"]
+    raw["score_n"] = raw["score"] * raw["n"]
+    raw["score_w"] = raw["score"] * raw["weight"]
+
+    g = raw.groupby("week").sum(numeric_only=True)
+    counts = raw.pivot_table(index="week", columns="score", values="n", aggfunc="sum", fill_value=0)
+    counts = counts.reindex(columns=SCORES, fill_value=0)
+
+    weekly = pd.DataFrame(index=g.index)
+    weekly["n"] = g["n"]
+    weekly["weight"] = g["weight"]
+    weekly["avg_score"] = g["score_n"] / g["n"]
+    weekly["weighted_score"] = g["score_w"] / g["weight"]
+    weekly["reply_rate"] = g["replied"] / g["n"]
+    weekly["avg_reply_hours"] = (g["reply_sec"] / g["reply_timed"].replace(0, np.nan)) / 3600.0
+    shares = counts.div(counts.sum(axis=1), axis=0)
+    for s in SCORES:
+        weekly[f"share_{s}"] = shares[s]
+    return weekly.sort_index()
+
+
+def _summary(weekly: pd.DataFrame, latency: tuple | None) -> dict[str, Any]:
+    if weekly.empty:
+        return {"reviews": 0}
+    n = weekly["n"]
+    weight = weekly["weight"]
+    total = int(n.sum())
+    distribution = weekly[[f"share_{s}" for s in SCORES]].mul(n, axis=0).sum() / total
+    p50, p90 = (latency[0] if latency and latency[0] else [None, None])[:2]
+    return {
+        "reviews": total,
+        "avg_score": round(float((weekly["avg_score"] * n).sum() / total), 3),
+        "weighted_score": round(float((weekly["weighted_score"] * weight).sum() / weight.sum()), 3),
+        "reply_rate": round(float((weekly["reply_rate"] * n).sum() / total), 3),
+        "reply_latency_p50_hours": round(p50 / 3600.0, 1) if p50 is not None else None,
+        "reply_latency_p90_hours": round(p90 / 3600.0, 1) if p90 is not None else None,
+        "distribution": {s: round(float(distribution[f"share_{s}"]), 3) for s in SCORES},
+        "weeks": len(weekly),
+    }
+
+
+def _version_frame(rows: list[tuple]) -> pd.DataFrame:
+    columns = ["version", "n", "avg_score", "weighted_score", "reply_rate", "first_seen", "last_seen"]
+    df = pd.DataFrame(rows, columns=columns)
+    if df.empty:
+        return df.set_index("version")
+    df = df.astype({"n": "int64", "avg_score": "float64", "weighted_score": "float64", "reply_rate": "float64"})
+    return df.set_index("version")
+
+
+def compute_review_analytics(
+    db: Database,
+    *,
+    app_id: str,
+    lang: str = DEFAULT_LANG,
+    country: str = DEFAULT_COUNTRY,
+    since: datetime | None = None,
+) -> ReviewAnalytics:
+    since = since or utcnow() - timedelta(days=REVIEW_ANALYTICS_WINDOW_DAYS)
+    params = (app_id, lang, country, since)
+    with db.connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_WEEKLY_SQL, params)
+            weekly_rows = cur.fetchall()
+            cur.execute(_VERSION_SQL, (*params, REVIEW_ANALYTICS_MAX_VERSIONS))
+            version_rows = cur.fetchall()
+            cur.execute(_REPLY_LATENCY_SQL, params)
+            latency = cur.fetchone()
+
+    weekly = _weekly_frame(weekly_rows)
+    return ReviewAnalytics(
+        app_id=app_id,
+        lang=lang,
+        country=country,
+        since=since,
+        computed_at=utcnow(),
+        summary=_summary(weekly, latency),
+        weekly=weekly,
+        by_version=_version_frame(version_rows),
+    )
+
+
+def get_review_analytics(
+    db: Database,
+    *,
+    app_id: str,
+    lang: str = DEFAULT_LANG,
+    country: str = DEFAULT_COUNTRY,
+    window_days: int | None = None,
+) -> ReviewAnalytics:
+    window_days = window_days or REVIEW_ANALYTICS_WINDOW_DAYS
+    # Отзывы вставляют worker и cron, а не процесс с этим кэшем: версию читаем из БД (поиск по PK),
+    # записи со старой версией просто вытесняются LRU. TTL лишь сдвигает окно «последних N дней».
+    version = db.get_reviews_version(app_id=app_id, lang=lang, country=country)
+    key = (db.database_url, app_id, lang, country, window_days, version)
+    cached = _CACHE.get(key)
+    if cached is not None:
+        return cached
+    result = compute_review_analytics(
+        db, app_id=app_id, lang=lang, country=country, since=utcnow() - timedelta(days=window_days)
+    )
+    _CACHE.set(key, result)
+    return result
+
+
+def cache_stats() -> dict[str, int]:
+    return _CACHE.stats()
@@ -4,9 +4,21 @@ import random
 import time
 from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Any
+from typing import Any, Iterator
 
 import google_play_scraper as gps
+from google_play_scraper.constants.element import ElementSpecs
+from google_play_scraper.constants.request import Formats
+from google_play_scraper.features.reviews import MAX_COUNT_EACH_FETCH, _ContinuationToken, _fetch_review_items
+
+from config import get_env_float, get_env_int
+from ratelimit import TokenBucket
+
+
+GPLAY_LIMITER = TokenBucket(
+    rate=get_env_float("GPLAY_RATE_PER_SEC", 2.0),
+    burst=get_env_int("GPLAY_RATE_BURST", 2),
+)
 
 
 def utcnow() -> datetime:
@@ -105,6 +117,7 @@ def _safe_int(v: Any) -> int | None:
 
 def scrape_app_meta(app_id: str, *, lang: str = "en", country: str = "us") -> tuple[ScrapedMeta, ScrapedDeveloper | None, list[dict[str, Any]]]:
     def _call():
+        GPLAY_LIMITER.acquire()
         return gps.app(app_id, lang=lang, country=country)
 
     data = with_retries(_call, attempts=3)
@@ -166,6 +179,33 @@ def scrape_app_meta(app_id: str, *, lang: str = "en", country: str = "us") -> tu
     return meta, dev, perms
 
 
+def _normalize_review(r: dict[str, Any]) -> dict[str, Any]:
+    date_val = r.get("at")
+    if isinstance(date_val, datetime):
+        date_dt = date_val if date_val.tzinfo else date_val.replace(tzinfo=timezone.utc)
+    else:
+        date_dt = None
+
+    replied_at_val = r.get("repliedAt")
+    if isinstance(replied_at_val, datetime):
+        replied_at_dt = replied_at_val if replied_at_val.tzinfo else replied_at_val.replace(tzinfo=timezone.utc)
+    else:
+        replied_at_dt = None
+
+    return {
+        "review_id": r.get("reviewId") or r.get("review_id"),
+        "user_name": r.get("userName"),
+        "user_image": r.get("userImage"),
+        "content": r.get("content"),
+        "score": _safe_int(r.get("score")),
+        "thumbs_up": _safe_int(r.get("thumbsUpCount")),
+        "version": r.get("reviewCreatedVersion"),
+        "date": date_dt,
+        "replied_at": replied_at_dt,
+        "reply_content": r.get("replyContent"),
+    }
+
+
 def scrape_reviews(
     app_id: str,
     *,
@@ -178,37 +218,131 @@ def scrape_reviews(
         kwargs: dict[str, Any] = {"app_id": app_id, "lang": lang, "country": country, "count": count}
         if sort is not None:
             kwargs["sort"] = sort
+        GPLAY_LIMITER.acquire()
         result, _ = gps.reviews(**kwargs)
         return result
 
     raw_reviews = with_retries(_call, attempts=3)
-    out: list[dict[str, Any]] = []
-    for r in raw_reviews or []:
-        date_val = r.get("at")
-        if isinstance(date_val, datetime):
-            date_dt = date_val if date_val.tzinfo else date_val.replace(tzinfo=timezone.utc)
-        else:
-            date_dt = None
-
-        replied_at_val = r.get("repliedAt")
-        if isinstance(replied_at_val, datetime):
-            replied_at_dt = replied_at_val if replied_at_val.tzinfo else replied_at_val.replace(tzinfo=timezone.utc)
-        else:
-            replied_at_dt = None
-
-        out.append(
-            {
-                "review_id": r.get("reviewId") or r.get("review_id"),
-                "user_name": r.get("userName"),
-                "user_image": r.get("userImage"),
-                "content": r.get("content"),
-                "score": _safe_int(r.get("score")),
-                "thumbs_up": _safe_int(r.get("thumbsUpCount")),
-                "version": r.get("reviewCreatedVersion"),
-                "date": date_dt,
-                "replied_at": replied_at_dt,
-                "reply_content": r.get("replyContent"),
-            }
-        )
+    return [_normalize_review(r) for r in raw_reviews or []]
+
+
+def continuation_token_to_dict(token: Any) -> dict[str, Any] | None:
+    if token is None or token.token is None:
+        return None
+    return {
+        "token": token.token,
+        "lang": token.lang,
+        "country": token.country,
+        "sort": token.sort,
+        "count": token.count,
+        "filter_score_with": token.filter_score_with,
+        "filter_device_with": token.filter_device_with,
+    }
+
+
+def continuation_token_from_dict(data: dict[str, Any] | None) -> Any:
+    if not data or not data.get("token"):
+        return None
+    return _ContinuationToken(
+        data.get("token"),
+        data.get("lang"),
+        data.get("country"),
+        data.get("sort"),
+        data.get("count"),
+        data.get("filter_score_with"),
+        data.get("filter_device_with"),
+    )
 
-    return out
+
+# Одна страница — ровно один запрос. gps.reviews добирает count в цикле и глотает ошибку любого
+# запроса, возвращая собранное с token=None — неотличимо от конца ленты. Здесь ошибка долетает
+# до with_retries, а token=None значит только конец ленты.
+def _fetch_review_page(
+    app_id: str, *, lang: str, country: str, count: int, token: Any
+) -> tuple[list[dict[str, Any]], Any]:
+    if token is None:
+        token = _ContinuationToken(None, lang, country, gps.Sort.NEWEST.value, count, None, None)
+    GPLAY_LIMITER.acquire()
+    items, next_token = _fetch_review_items(
+        Formats.Reviews.build(lang=token.lang, country=token.country),
+        app_id,
+        token.sort,
+        token.count,
+        token.filter_score_with,
+        token.filter_device_with,
+        token.token,
+    )
+    if isinstance(next_token, list):
+        next_token = None
+    raw = [{k: spec.extract_content(item) for k, spec in ElementSpecs.Review.items()} for item in items]
+    return raw, _ContinuationToken(
+        next_token,
+        token.lang,
+        token.country,
+        token.sort,
+        token.count,
+        token.filter_score_with,
+        token.filter_device_with,
+    )
+
+
+def iter_review_pages(
+    app_id: str,
+    *,
+    lang: str = "en",
+    country: str = "us",
+    page_size: int = 100,
+    continuation_token: Any = None,
+) -> Iterator[tuple[list[dict[str, Any]], Any]]:
+    token = continuation_token
+    page_size = max(1, min(page_size, MAX_COUNT_EACH_FETCH))
+    while True:
+        def _call(token=token):
+            return _fetch_review_page(app_id, lang=lang, country=country, count=page_size, token=token)
+
+        raw_reviews, token = with_retries(_call, attempts=3)
+        page = [_normalize_review(r) for r in raw_reviews]
+        yield page, token
+        if not page or token.token is None:
+            return
+
+
+# Итог прохода scrape_reviews_since:
+#   reached   — дошли до границы since_*;
+#   end       — лента кончилась, а границы не было (первый скрейп);
+#   truncated — исчерпан max_count, продолжать с возвращённого токена;
+#   broken    — лента кончилась раньше границы (граничный отзыв удалён или выдача неполная).
+# Ошибки запросов не глотаются: исключение поднимается к вызывающему.
+def scrape_reviews_since(
+    app_id: str,
+    *,
+    lang: str = "en",
+    country: str = "us",
+    since_review_id: str | None,
+    since_date: datetime | None,
+    max_count: int,
+    page_size: int = 100,
+    continuation_token: Any = None,
+) -> tuple[list[dict[str, Any]], str, Any]:
+    has_bound = since_review_id is not None or since_date is not None
+    out: list[dict[str, Any]] = []
+    pages = iter_review_pages(
+        app_id,
+        lang=lang,
+        country=country,
+        page_size=min(page_size, max_count),
+        continuation_token=continuation_token,
+    )
+    for page, token in pages:
+        for r in page:
+            if since_review_id is not None and r["review_id"] == since_review_id:
+                return out, "reached", None
+            if since_date is not None and r["date"] is not None and r["date"] < since_date:
+                return out, "reached", None
+            out.append(r)
+        if not page or token.token is None:
+            break
+        # Бюджет проверяем на границе страницы: токен указывает ровно за последнюю взятую строку
+        if len(out) >= max_count:
+            return out, "truncated", token
+    return out, "broken" if has_bound else "end", None
@@ -0,0 +1,109 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import timedelta
+from typing import Any
+
+from config import get_env_float, get_env_int
+from db import Database, Job, new_lease_owner
+from pipeline import run_user_pipeline
+
+
+JOB_WORKERS = get_env_int("JOB_WORKERS", 4)
+JOB_POLL_SEC = get_env_float("JOB_POLL_SEC", 1.0)
+JOB_LEASE_SEC = get_env_int("JOB_LEASE_SEC", 600)
+JOB_HEARTBEAT_SEC = get_env_float("JOB_HEARTBEAT_SEC", max(1.0, JOB_LEASE_SEC / 3))
+JOB_MAX_ATTEMPTS = get_env_int("JOB_MAX_ATTEMPTS", 3)
+JOB_RETENTION_DAYS = get_env_int("JOB_RETENTION_DAYS", 7)
+
+
+def _progress_reporter(db: Database, job: Job):
+    def report(progress: dict[str, Any]) -> None:
+        try:
+            db.update_job_progress(job_id=job.id, progress=progress)
+        except Exception as e:  # noqa: BLE001
+            print({"job_id": job.id, "status": "progress_error", "error": str(e)})
+
+    return report
+
+
+def _heartbeat(db: Database, job: Job, owner: str, stop: threading.Event) -> None:
+    # Ожидание блокировки и ретраи LLM могут быть дольше JOB_LEASE_SEC: продлеваем аренду, пока идёт запуск
+    while not stop.wait(JOB_HEARTBEAT_SEC):
+        try:
+            if not db.renew_job_lease(job_id=job.id, owner=owner, attempts=job.attempts, lease_seconds=JOB_LEASE_SEC):
+                print({"job_id": job.id, "status": "lease_lost"})
+                return
+        except Exception as e:  # noqa: BLE001
+            print({"job_id": job.id, "status": "heartbeat_error", "error": str(e)})
+
+
+def run_job(db: Database, job: Job, owner: str) -> None:
+    started = time.perf_counter()
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(db, job, owner, stop), daemon=True)
+    heartbeat.start()
+    try:
+        if job.kind == "analysis":
+            result = run_user_pipeline(**job.params, on_progress=_progress_reporter(db, job))
+        else:
+            raise RuntimeError(f"Unknown job kind: {job.kind}")
+    except Exception as e:  # noqa: BLE001
+        stop.set()
+        failed = db.fail_job(job_id=job.id, owner=owner, attempts=job.attempts, error=str(e))
+        print({"job_id": job.id, "kind": job.kind, "status": "failed" if failed else "lease_lost", "error": str(e)})
+        return
+    finally:
+        stop.set()
+
+    # Вне try выше: ошибка после коммита результата не должна превращать задание в failed
+    try:
+        completed = db.complete_job(job_id=job.id, owner=owner, attempts=job.attempts, result=result)
+    except Exception as e:  # noqa: BLE001
+        print({"job_id": job.id, "kind": job.kind, "status": "complete_error", "error": str(e)})
+        return
+    print(
+        {
+            "job_id": job.id,
+            "kind": job.kind,
+            "status": "done" if completed else "lease_lost",
+            "elapsed_sec": round(time.perf_counter() - started, 3),
+            "timings_sec": result.get("timings_sec") if isinstance(result, dict) else None,
+        }
+    )
+
+
+def main() -> None:
+    db = Database()
+    owner = new_lease_owner()
+    workers = max(1, JOB_WORKERS)
+
+    purged = db.purge_jobs(older_than=timedelta(days=JOB_RETENTION_DAYS))
+    print({"worker": owner, "workers": workers, "purged_jobs": purged})
+
+    in_flight: set[Future] = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            free = workers - len(in_flight)
+            if free > 0:
+                try:
+                    jobs = db.claim_jobs(
+                        owner=owner,
+                        limit=free,
+                        lease_seconds=JOB_LEASE_SEC,
+                        max_attempts=JOB_MAX_ATTEMPTS,
+                    )
+                except Exception as e:  # noqa: BLE001
+                    print({"worker": owner, "status": "claim_error", "error": str(e)})
+                    jobs = []
+                for job in jobs:
+                    in_flight.add(executor.submit(run_job, db, job, owner))
+
+            if in_flight:
+                _, in_flight = wait(in_flight, timeout=JOB_POLL_SEC, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(JOB_POLL_SEC)
+
+
+if __name__ == "__main__":
+    main()